@@ -0,0 +1,118 @@
+"""
+Adversarial and fuzz suite for check_for_link.
+
+Every crafted message, up to Discord's 4000 character limit, must be scanned
+within CEILING_MS, and the scanner must classify fuzzed messages exactly like
+the previous four-regex version.
+
+Usage: python -m benchmarks.adversarial_links
+"""
+
+import random
+import sys
+from time import perf_counter
+from typing import Callable, Dict, List
+
+from benchmarks.links import legacy_check_for_link
+from links import check_for_link
+
+MAX_MESSAGE_LENGTH = 4000
+CEILING_MS = 10
+FRAGMENTS = [
+    "https://", "http://", "http:", "www.", "ww", "w", "m.", "vm", ".",
+    "tiktok", ".com", "tiktok.com", "/", "@", "@ab", "video", "/video/",
+    "v/", "item_id=", "item_id=123456", "12345", "1234567890123456789",
+    "abcde", "foryou", "?", "#", "_", " ", "\n", "٣٣٣٣٣",
+]  # fmt: skip
+
+
+def fill(unit: str) -> str:
+    return (unit * (MAX_MESSAGE_LENGTH // len(unit) + 1))[:MAX_MESSAGE_LENGTH]
+
+
+ADVERSARIAL: Dict[str, str] = {
+    "repeated domain": fill(".tiktok.com/"),
+    "repeated www domain": fill("www.tiktok.com/"),
+    "repeated https domain": fill("https://www.tiktok.com/"),
+    "fyp without item id": ".tiktok.com/" + fill("item_id="),
+    "fyp with short item ids": ".tiktok.com/" + fill("item_id=1234&"),
+    "domain then item ids per line": fill("www.tiktok.com/foryou?item_id=1\n"),
+    "long handle": "tiktok.com/@" + fill("a"),
+    "repeated handles": fill("tiktok.com/@abcdefghijklmnopqrstuvwx/vide"),
+    "repeated short prefix": fill("vm.tiktok.com/abcd "),
+    "valid link at the end": fill("tiktok.com/ ")[:-60]
+    + " https://www.tiktok.com/@user/video/7068971038273423621",
+}
+
+
+SUBDOMAIN_LINKS = [
+    "https://m.tiktok.com/@user/video/7068971038273423621",
+    "https://us.tiktok.com/@user/video/7068971038273423621",
+    "vm.tiktok.com/@user/video/7068971038273423621",
+    "look http://t.tiktok.com/@user.name/video/7068971038273423621?lang=en",
+    "https://www.m.tiktok.com/@user/video/7068971038273423621",
+]  # long links after a subdomain other than www., rarely built by the fuzzer
+
+
+def time_ms(check: Callable[[str], object], message: str, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        check(message)
+        best = min(best, perf_counter() - start)
+    return best * 1000
+
+
+def fuzz_messages(count: int, max_fragments: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choices(FRAGMENTS, k=rng.randint(1, max_fragments)))[
+            :MAX_MESSAGE_LENGTH
+        ]
+        for _ in range(count)
+    ]
+
+
+def run() -> List[str]:
+    """
+    Runs the suite.
+
+    returns:
+        The failures, empty when everything passed.
+    """
+    failures = []
+
+    for name, message in ADVERSARIAL.items():
+        scanner = time_ms(check_for_link, message)
+        legacy = time_ms(legacy_check_for_link, message, repeat=1)
+        print(f"{name:32} scanner {scanner:7.3f}ms  legacy {legacy:8.3f}ms")
+        if scanner > CEILING_MS:
+            failures.append(f"{name}: {scanner:.3f}ms > {CEILING_MS}ms")
+        if check_for_link(message) != legacy_check_for_link(message):
+            failures.append(f"{name}: classified differently")
+
+    for message in SUBDOMAIN_LINKS:
+        link = check_for_link(message)
+        if link is None or link != legacy_check_for_link(message):
+            failures.append(f"{message}: classified as {link}")
+
+    slowest = 0.0
+    for message in fuzz_messages(200, 1000, seed=1):
+        slowest = max(slowest, time_ms(check_for_link, message, repeat=1))
+    print(f"{'slowest long fuzzed message':32} scanner {slowest:7.3f}ms")
+    if slowest > CEILING_MS:
+        failures.append(f"long fuzzed message: {slowest:.3f}ms > {CEILING_MS}ms")
+
+    for message in fuzz_messages(100000, 25, seed=2):
+        if check_for_link(message) != legacy_check_for_link(message):
+            failures.append(f"fuzzed message classified differently: {message!r}")
+            break
+
+    return failures
+
+
+if __name__ == "__main__":
+    failures = run()
+    for failure in failures:
+        print("FAIL", failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,88 @@
+"""
+Microbenchmark of clean_desc against the previous replace-per-hashtag version
+on hashtag heavy descriptions.
+
+Part of the descriptions have emoji before the hashtags, with offsets counted
+in UTF-16 code units, so the UTF-16 offset mapping is measured too.
+
+Usage: python -m benchmarks.clean_desc [DESCRIPTIONS]
+"""
+
+import random
+import re
+import sys
+from timeit import timeit
+from typing import List, Tuple
+
+from tiktok import clean_desc
+
+WORDS = "wait for the end omg this is so good part 2 coming soon lol".split()
+TAGS = (
+    "fyp foryou foryoupage viral funny dance cat dog cooking recipe asmr trend "
+    "comedy music art fitness travel duet xyzbca learnontiktok booktok"
+).split()
+
+
+def legacy_clean_desc(text_extra, desc) -> str:
+    """clean_desc as it was before hashtags were cut by offset."""
+    for tag in text_extra:
+        if tag.get("type") == 1:
+            desc: str
+            desc = desc.lower().replace(f"#{tag.get('hashtag_name').lower()}", "", 1)
+            desc = re.sub(r"\s+", " ", desc)
+    return desc.strip()
+
+
+def make_description(rng: random.Random, tags: int) -> Tuple[list, str]:
+    desc = " ".join(rng.choices(WORDS, k=rng.randint(5, 40)))
+    if rng.random() < 0.3:
+        desc += " \N{FACE WITH TEARS OF JOY}"
+    text_extra = []
+    for name in rng.sample(TAGS, k=min(tags, len(TAGS))):
+        hashtag = "#" + rng.choice([name, name.capitalize(), name.upper()])
+        desc += "  " if rng.random() < 0.2 else " "
+        start = len(desc.encode("utf-16-le")) // 2
+        desc += hashtag
+        text_extra.append(
+            {
+                "start": start,
+                "end": start + len(hashtag),
+                "type": 1,
+                "hashtag_name": name,
+            }
+        )
+    return text_extra, desc
+
+
+def make_corpus(size: int, seed: int = 0) -> List[Tuple[list, str]]:
+    rng = random.Random(seed)
+    return [make_description(rng, rng.choice((5, 10, 20, 30))) for _ in range(size)]
+
+
+def run(size: int = 2000) -> dict:
+    corpus = make_corpus(size)
+    for text_extra, desc in corpus:
+        assert clean_desc(text_extra, desc).lower() == legacy_clean_desc(
+            text_extra, desc
+        ), desc
+
+    legacy = timeit(
+        lambda: [legacy_clean_desc(tags, desc) for tags, desc in corpus], number=5
+    )
+    current = timeit(
+        lambda: [clean_desc(tags, desc) for tags, desc in corpus], number=5
+    )
+    return {
+        "descriptions": size,
+        "legacy_us": legacy / 5 / size * 1e6,
+        "current_us": current / 5 / size * 1e6,
+        "speedup": legacy / current,
+    }
+
+
+if __name__ == "__main__":
+    result = run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
+    print(
+        "%(descriptions)d descriptions: legacy %(legacy_us).1fus, "
+        "current %(current_us).1fus per description (%(speedup).1fx)" % result
+    )
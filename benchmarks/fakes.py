@@ -0,0 +1,208 @@
+"""
+In-process stand-ins for everything the conversion path talks to, so the
+benchmarks run offline and repeatably.
+
+- MongoDB is an in-memory mongomock-motor database behind beanie, with the
+  same unique indexes as production.
+- api2 aweme responses are served from the checked-in corpus.
+- Discord messages, channels and button contexts record what the bot sends.
+  Their REST calls go through `rest`, which counts them and can add latency.
+
+Requires mongomock-motor, see benchmarks/requirements.txt.
+"""
+
+import asyncio
+from collections import Counter
+from itertools import count
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import dis_snek as dis
+from beanie import init_beanie
+from mongomock_motor import AsyncMongoMockClient
+
+import bot
+import tiktok
+from database import Config, OptedOut, ShortLink, Shortener, UsageData
+
+BOT_USER_ID = 900000000000000000
+
+_ids = count(1000000000000000000)
+
+
+async def init_database(short_links: Optional[Dict[str, int]] = None) -> None:
+    """
+    Points every document model at a fresh in-memory database.
+
+    args:
+        short_links: Slugs to store as already resolved.
+    """
+    await init_beanie(
+        database=AsyncMongoMockClient().tiktoker,
+        document_models=[Config, UsageData, Shortener, OptedOut, ShortLink],
+    )
+    if short_links:
+        await ShortLink.insert_many(
+            [ShortLink(slug=slug, video_id=id) for slug, id in short_links.items()]
+        )
+
+
+def serve_payloads(payloads: Dict[int, bytes]) -> None:
+    """
+    Answers `tiktok.fetch_tiktok` from response bodies instead of api2.
+
+    args:
+        payloads: Response bodies by aweme id.
+    """
+
+    async def fetch_tiktok(video_id: int, shed: bool = False) -> "tiktok.TikTokData":
+        if (body := payloads.get(int(video_id))) is None:
+            raise ValueError("Unable to get TikTok data")
+        data = tiktok.json.loads(body)
+        return tiktok.TikTokData.from_dict(data["aweme_detail"])
+
+    tiktok.fetch_tiktok = fetch_tiktok
+
+
+def clear_caches() -> None:
+    """Empties every in-memory cache of the bot."""
+    tiktok.tiktok_cache.clear()
+    tiktok.unavailable_videos.clear()
+    bot.short_url_cache.clear()
+    bot.short_link_cache.clear()
+    bot.failed_short_links.clear()
+    bot.guild_configs.clear()
+
+
+class FakeREST:
+    """
+    Stands in for Discord's REST API. Every call is counted by route and, with
+    a `latency`, waits for a delay drawn from it.
+    """
+
+    def __init__(self, latency: Optional[Callable[[], float]] = None) -> None:
+        self.latency = latency
+        self.calls = Counter()
+
+    async def request(self, route: str) -> None:
+        self.calls[route] += 1
+        if self.latency and (delay := self.latency()) > 0:
+            await asyncio.sleep(delay)
+
+
+rest = FakeREST()
+
+
+class FakeChannel:
+    """A text channel that keeps the messages sent to it."""
+
+    def __init__(self, id: int) -> None:
+        self.id = id
+        self.sent: List["FakeMessage"] = []
+
+    async def send(self, content: str = None, **kwargs) -> "FakeMessage":
+        await rest.request("create_message")
+        message = FakeMessage(content, channel=self, author_id=BOT_USER_ID)
+        message.kwargs = kwargs
+        self.sent.append(message)
+        return message
+
+
+class FakeMessage:
+    """A message as seen by the listeners, with the calls the bot makes."""
+
+    def __init__(
+        self,
+        content: str,
+        channel: FakeChannel,
+        author_id: int,
+        guild_id: int = 0,
+    ) -> None:
+        self.id = next(_ids)
+        self.content = content
+        self.channel = channel
+        self._channel_id = channel.id
+        self.author = SimpleNamespace(id=author_id, mention=f"<@{author_id}>")
+        self.guild = SimpleNamespace(id=guild_id)
+        self.kwargs = {}
+        self.deleted = False
+        self.embeds_suppressed = False
+
+    async def reply(self, content: str = None, **kwargs) -> "FakeMessage":
+        return await self.channel.send(content, **kwargs)
+
+    async def delete(self) -> None:
+        await rest.request("delete_message")
+        self.deleted = True
+
+    async def suppress_embeds(self) -> None:
+        await rest.request("edit_message")
+        self.embeds_suppressed = True
+
+
+class FakeContext:
+    """The interaction context of a button click."""
+
+    def __init__(
+        self, custom_id: str, channel: FakeChannel, author_id: int, guild_id: int
+    ) -> None:
+        self.custom_id = custom_id
+        self.channel = channel
+        self.guild = SimpleNamespace(id=guild_id)
+        self.author = SimpleNamespace(
+            id=author_id,
+            channel_permissions=lambda channel: dis.Permissions.NONE,
+            has_permission=lambda *permissions: False,
+        )
+        self.message = FakeMessage(None, channel, BOT_USER_ID, guild_id=guild_id)
+        self.responses: List[dict] = []
+
+    async def defer(self, ephemeral: bool = False) -> None:
+        await rest.request("create_interaction_response")
+
+    async def send(self, content: str = None, **kwargs) -> None:
+        await rest.request("create_followup_message")
+        self.responses.append(dict(kwargs, content=content))
+
+    async def delete(self) -> None:
+        await rest.request("delete_original_response")
+
+
+def message_event(
+    content: str, guild_id: int = 1, author_id: int = 2, channel: FakeChannel = None
+) -> SimpleNamespace:
+    """
+    Builds a MessageCreate event for `bot.on_message_create`.
+
+    returns:
+        An object with the `message` attribute the listener reads.
+    """
+    channel = channel or FakeChannel(next(_ids))
+    return SimpleNamespace(
+        message=FakeMessage(content, channel, author_id, guild_id=guild_id)
+    )
+
+
+def button_event(
+    custom_id: str, guild_id: int = 1, author_id: int = 2, channel: FakeChannel = None
+) -> SimpleNamespace:
+    """
+    Builds a Button event for `bot.on_button_click`.
+
+    returns:
+        An object with the `context` attribute the listener reads.
+    """
+    channel = channel or FakeChannel(next(_ids))
+    return SimpleNamespace(
+        context=FakeContext(custom_id, channel, author_id, guild_id=guild_id)
+    )
+
+
+def install_client() -> None:
+    """Gives the bot a user and answers channel fetches without the REST API."""
+
+    async def fetch_channel(channel_id: int) -> None:
+        await rest.request("get_channel")
+
+    bot.bot._user = SimpleNamespace(id=BOT_USER_ID)
+    bot.bot.fetch_channel = fetch_channel
@@ -0,0 +1,34 @@
+"""
+Loads the checked-in corpus of benchmarks/corpus.
+"""
+
+import json
+from glob import glob
+from os import path
+from typing import Dict, List, Tuple
+
+CORPUS_DIR = path.join(path.dirname(__file__), "corpus")
+
+
+def load_payloads() -> Dict[int, bytes]:
+    """
+    returns:
+        Every aweme_detail response body of the corpus, by aweme id.
+    """
+    payloads = {}
+    for file in sorted(glob(path.join(CORPUS_DIR, "aweme", "*.json"))):
+        with open(file, "rb") as body:
+            payload = body.read()
+        payloads[int(json.loads(payload)["aweme_detail"]["aweme_id"])] = payload
+    return payloads
+
+
+def load_messages() -> Tuple[List[str], Dict[str, int]]:
+    """
+    returns:
+        The message samples of the corpus and the video id every vm.tiktok.com
+        slug in them points to.
+    """
+    with open(path.join(CORPUS_DIR, "messages.json"), encoding="utf-8") as file:
+        corpus = json.load(file)
+    return corpus["messages"], corpus["short_links"]
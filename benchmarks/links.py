@@ -0,0 +1,153 @@
+"""
+Microbenchmark of check_for_link against the previous four-regex version.
+
+Usage: python -m benchmarks.links [MESSAGES]
+"""
+
+import random
+import re
+import sys
+from timeit import timeit
+from typing import List, Optional
+
+from links import check_for_link
+from models import LinkData, VideoIdType
+
+WORDS = (
+    "the a lol this is so funny did you see what happened yesterday at the game "
+    "anyone up for ranked tonight i think we should try the new map honestly "
+    "that boss fight took forever brb dinner gg wp nice clip bro"
+).split()
+OTHER_URLS = [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://twitter.com/someone/status/1503412345678901234",
+    "https://cdn.discordapp.com/attachments/9485/9481/clip.mp4",
+    "https://www.reddit.com/r/aww/comments/t8x9yz/so_cute/",
+]
+TIKTOK_URLS = [
+    "https://www.tiktok.com/@placeholder/video/7068971038273423621",
+    "https://vm.tiktok.com/PTPdh1wVay/",
+    "https://m.tiktok.com/v/7068971038273423621.html",
+    "https://www.tiktok.com/foryou?_r=1&is_from_webapp=v1&item_id=7068971038273423621",
+    "www.tiktok.com/@some.user_name/video/7071234567890123456?is_copy_url=1",
+]
+
+
+def legacy_check_for_link(content: str) -> Optional["LinkData"]:
+    """check_for_link as it was before the single-pass scanner."""
+    try:
+        fyp_match = re.search(
+            r"(?P<http>http:|https:\/\/)?(www)?\.tiktok.com\/(.*)item_id=(?P<item_id>\d{5,30})",
+            content,
+        )
+        long_match = re.search(
+            r"(?P<http>http:|https:\/\/)?(www\.)?tiktok\.com\/(@.{1,24})\/video\/(?P<id>\d{15,30})",
+            content,
+        )
+        short_match = re.search(
+            r"(?P<http>http:|https:\/\/)?((?!ww)\w{2})\.tiktok.com\/(?P<short_id>\w{5,15})",
+            content,
+        )
+        medium_match = re.search(
+            r"(?P<http>http:|https:\/\/)?m\.tiktok\.com\/v\/(?P<id>\d{15,30})", content
+        )
+    except TypeError as e:
+        print(f"{content} is not a string")
+        print(type(content))
+    if long_match:
+        if not long_match.group("http"):
+            return LinkData.from_list(
+                [
+                    VideoIdType.LONG,
+                    long_match.group("id"),
+                    f"https://{long_match.group(0)}",
+                ]
+            )
+        return LinkData.from_list(
+            [VideoIdType.LONG, long_match.group("id"), long_match.group(0)]
+        )
+    if short_match:
+        if not short_match.group("http"):
+            return LinkData.from_list(
+                [
+                    VideoIdType.SHORT,
+                    short_match.group("short_id"),
+                    f"https://{short_match.group(0)}",
+                ]
+            )
+        return LinkData.from_list(
+            [VideoIdType.SHORT, short_match.group("short_id"), short_match.group(0)]
+        )
+    if medium_match:
+        if not medium_match.group("http"):
+            return LinkData.from_list(
+                [
+                    VideoIdType.MEDIUM,
+                    medium_match.group("id"),
+                    f"https://{medium_match.group(0)}",
+                ]
+            )
+        return LinkData.from_list(
+            [VideoIdType.MEDIUM, medium_match.group("id"), medium_match.group(0)]
+        )
+    if fyp_match:
+        if not fyp_match.group("http"):
+            return LinkData.from_list(
+                [
+                    VideoIdType.FYP,
+                    fyp_match.group("item_id"),
+                    f"https://{fyp_match.group(0)}",
+                ]
+            )
+        return LinkData.from_list(
+            [VideoIdType.FYP, fyp_match.group("item_id"), fyp_match.group(0)]
+        )
+    return None
+
+
+def make_corpus(size: int, tiktok_ratio: float = 0.01, seed: int = 0) -> List[str]:
+    """
+    Builds chat messages, about `tiktok_ratio` of them with a TikTok link.
+
+    args:
+        size: The number of messages.
+        tiktok_ratio: The share of messages with a TikTok link.
+        seed: Seeds the generator so runs are comparable.
+
+    returns:
+        The messages.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        words = rng.choices(WORDS, k=rng.randint(1, 40))
+        if rng.random() < 0.05:
+            words.insert(rng.randint(0, len(words)), rng.choice(OTHER_URLS))
+        if rng.random() < tiktok_ratio:
+            words.insert(rng.randint(0, len(words)), rng.choice(TIKTOK_URLS))
+        corpus.append(" ".join(words))
+    return corpus
+
+
+def run(size: int = 20000) -> dict:
+    corpus = make_corpus(size)
+    for message in corpus:
+        assert check_for_link(message) == legacy_check_for_link(message), message
+
+    legacy = timeit(lambda: [legacy_check_for_link(m) for m in corpus], number=3)
+    scanner = timeit(lambda: [check_for_link(m) for m in corpus], number=3)
+    return {
+        "messages": size,
+        "legacy_us_per_message": legacy / 3 / size * 1e6,
+        "scanner_us_per_message": scanner / 3 / size * 1e6,
+        "speedup": legacy / scanner,
+    }
+
+
+if __name__ == "__main__":
+    result = run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
+    print(
+        "%(messages)d messages: legacy %(legacy_us_per_message).2fus, "
+        "scanner %(scanner_us_per_message).2fus per message, "
+        "%(speedup).1fx faster" % result
+    )
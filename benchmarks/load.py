@@ -0,0 +1,254 @@
+"""
+Load test of the gateway listeners.
+
+Injects MessageCreate and Button events straight into `on_message_create` and
+`on_button_click` at a set rate, with Poisson arrivals and one task per event
+the way the gateway dispatches them. TikTok is the in-process stand-in server
+of benchmarks/tiktok_server.py, Discord the fake REST layer and MongoDB the
+in-memory database of benchmarks/fakes.py.
+
+Reports the throughput and the p50/p95/p99 latency end to end per event type
+and per stage: link scan, guild config, short link resolve, aweme fetch,
+shortener, Discord REST calls and usage insert.
+
+Usage: python -m benchmarks.load [--rate 200] [--duration 10] [--buttons 0.1]
+       [--fresh 0.3] [--latency lognormal:80,0.5] [--rest-latency fixed:40]
+       [--error-rate 0] [--throttle-rate 0] [--output FILE]
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import random
+from collections import Counter, defaultdict
+from time import perf_counter, perf_counter_ns
+from typing import Dict, List
+
+import bot
+import tiktok
+from benchmarks import fakes, fixtures
+from benchmarks.suite import commit, summarize
+from benchmarks.tiktok_server import TikTokServer, parse_latency
+from hedging import aweme_hedger
+from http_client import http_client
+from usage import usage_writer
+
+STAGES = (
+    (bot, "find_links", "link_scan"),
+    (bot, "get_guild_config", "guild_config"),
+    (bot, "get_video_id", "short_link"),
+    (bot, "get_tiktok", "aweme_fetch"),
+    (bot, "create_short_url", "shortener"),
+    (fakes.FakeREST, "request", "discord_rest"),
+    (bot, "insert_usage_data", "usage_insert"),
+)
+
+
+class Stages:
+    """Times every call of the wrapped functions, by stage."""
+
+    def __init__(self) -> None:
+        self.samples: Dict[str, List[int]] = defaultdict(list)
+
+    def wrap(self, owner, name: str, stage: str) -> None:
+        func = getattr(owner, name)
+        samples = self.samples[stage]
+
+        if inspect.iscoroutinefunction(func):
+
+            async def timed(*args, **kwargs):
+                start = perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    samples.append(perf_counter_ns() - start)
+
+        else:
+
+            def timed(*args, **kwargs):
+                start = perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    samples.append(perf_counter_ns() - start)
+
+        setattr(owner, name, timed)
+
+    def summary(self) -> Dict[str, dict]:
+        return {
+            stage: summarize(samples)
+            for stage, samples in self.samples.items()
+            if samples
+        }
+
+
+class Traffic:
+    """Draws the events of the load test."""
+
+    def __init__(
+        self, rng: random.Random, buttons: float, fresh: float, guilds: int
+    ) -> None:
+        self.rng = rng
+        self.buttons = buttons
+        self.fresh = fresh
+        self.guilds = guilds
+        self.messages, _ = fixtures.load_messages()
+        self.video_ids = list(fixtures.load_payloads())
+        self._fresh_ids = iter(range(7100000000000000000, 7200000000000000000))
+
+    def event(self):
+        guild_id = self.rng.randrange(self.guilds) + 1
+        author_id = self.rng.randrange(100000) + 1
+        if self.rng.random() < self.buttons:
+            kind = self.rng.choices(("v_id", "m_id"), (3, 1))[0]
+            custom_id = f"{kind}{self.rng.choice(self.video_ids)}"
+            return "button", fakes.button_event(custom_id, guild_id, author_id)
+
+        if self.rng.random() < self.fresh:
+            video_id = next(self._fresh_ids)
+            self.video_ids.append(video_id)
+            content = f"look https://www.tiktok.com/@someone/video/{video_id}"
+        else:
+            content = self.rng.choice(self.messages)
+        return "message", fakes.message_event(content, guild_id, author_id)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    server = TikTokServer(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        synthesize=True,
+        seed=args.seed,
+    )
+    url = await server.start(port=0)
+    tiktok.API_URL = bot.WEB_URL = bot.SHORT_URL = url
+
+    await fakes.init_database()
+    fakes.install_client()
+    fakes.rest.latency = parse_latency(args.rest_latency, rng)
+    await http_client.start()
+    await usage_writer.start()
+
+    stages = Stages()
+    for owner, name, stage in STAGES:
+        stages.wrap(owner, name, stage)
+    listeners = {
+        "message": bot.on_message_create.callback,
+        "button": bot.on_button_click.callback,
+    }
+    traffic = Traffic(rng, args.buttons, args.fresh, args.guilds)
+    end_to_end: Dict[str, List[int]] = defaultdict(list)
+    outcomes = Counter()
+    in_flight = set()
+    most_in_flight = 0
+
+    async def dispatch(kind: str, event) -> None:
+        start = perf_counter_ns()
+        try:
+            await listeners[kind](event)
+            outcomes[f"{kind}_ok"] += 1
+        except Exception as e:
+            outcomes[f"{kind}_error"] += 1
+            outcomes[type(e).__name__] += 1
+        end_to_end[kind].append(perf_counter_ns() - start)
+
+    loop = asyncio.get_running_loop()
+    started = perf_counter()
+    next_event = loop.time()
+    end = next_event + args.duration
+    while (next_event := next_event + rng.expovariate(args.rate)) < end:
+        await asyncio.sleep(max(next_event - loop.time(), 0))
+        task = asyncio.create_task(dispatch(*traffic.event()))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        most_in_flight = max(most_in_flight, len(in_flight))
+    if in_flight:
+        await asyncio.wait(in_flight, timeout=args.drain)
+    elapsed = perf_counter() - started
+    completed = sum(len(samples) for samples in end_to_end.values())
+
+    await usage_writer.close()
+    await http_client.close()
+    await server.close()
+
+    return {
+        "meta": {
+            "commit": commit(),
+            "rate": args.rate,
+            "duration": args.duration,
+            "buttons": args.buttons,
+            "fresh": args.fresh,
+            "latency": args.latency,
+            "rest_latency": args.rest_latency,
+            "error_rate": args.error_rate,
+            "throttle_rate": args.throttle_rate,
+        },
+        "results": {
+            "completed": completed,
+            "unfinished": len(in_flight),
+            "throughput_per_s": completed / elapsed,
+            "most_in_flight": most_in_flight,
+            "outcomes": dict(outcomes),
+            "end_to_end": {
+                kind: summarize(samples) for kind, samples in end_to_end.items()
+            },
+            "stages": stages.summary(),
+            "upstream": dict(server.served),
+            "discord_rest": dict(fakes.rest.calls),
+            "usage_writer": usage_writer.stats(),
+            "aweme_hedging": aweme_hedger.stats(),
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    results = report["results"]
+    print(
+        "%(completed)d events, %(throughput_per_s).1f/s, "
+        "%(most_in_flight)d in flight at most, %(unfinished)d unfinished" % results
+    )
+    print(f"{'':16} {'ops':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = [(f"{kind} (e2e)", s) for kind, s in results["end_to_end"].items()]
+    for name, summary in rows + list(results["stages"].items()):
+        print(
+            f"{name:16} {summary['ops']:7d} {summary['p50_us'] / 1000:9.2f} "
+            f"{summary['p95_us'] / 1000:9.2f} {summary['p99_us'] / 1000:9.2f}"
+        )
+    print("outcomes:", results["outcomes"])
+    print("upstream:", results["upstream"])
+    print("hedging:", results["aweme_hedging"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rate", type=float, default=200, help="events per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument(
+        "--buttons", type=float, default=0.1, help="share of Button events"
+    )
+    parser.add_argument(
+        "--fresh",
+        type=float,
+        default=0.3,
+        help="share of messages linking a video not seen before",
+    )
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--latency", default="lognormal:80,0.5", help="TikTok (ms)")
+    parser.add_argument("--rest-latency", default="lognormal:40,0.3", help="ms")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument(
+        "--drain", type=float, default=30, help="seconds to wait for stragglers"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to a file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(json.dumps(report, indent=2) + "\n")
@@ -0,0 +1,184 @@
+"""
+Benchmark suite for the conversion hot path.
+
+Runs every stage against the checked-in corpus with the stand-ins from
+benchmarks/fakes.py and prints one JSON document, so results of two commits
+can be diffed or compared with --compare.
+
+- check_for_link and find_links over the message samples
+- TikTokData.from_dict, with and without decoding the response body
+- clean_desc over the corpus descriptions
+- create_short_url against the in-memory database, new and cached uris
+- on_message_create end to end, with empty and warm caches
+
+Usage: python -m benchmarks.suite [--repeat N] [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from time import perf_counter_ns
+from typing import Awaitable, Callable, Dict, Iterable, List
+
+import bot
+import tiktok
+from benchmarks import fakes, fixtures
+from links import check_for_link, find_links
+from tiktok import TikTokData, clean_desc
+
+
+def summarize(samples: List[int]) -> Dict[str, float]:
+    """
+    args:
+        samples: Durations in nanoseconds.
+
+    returns:
+        The count, mean and percentiles in microseconds.
+    """
+    samples = sorted(samples)
+    percentile = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))]
+    return {
+        "ops": len(samples),
+        "mean_us": sum(samples) / len(samples) / 1000,
+        "p50_us": percentile(0.50) / 1000,
+        "p95_us": percentile(0.95) / 1000,
+        "p99_us": percentile(0.99) / 1000,
+    }
+
+
+def measure(func: Callable, items: Iterable, repeat: int) -> Dict[str, float]:
+    items = list(items)
+    samples = []
+    for _ in range(repeat):
+        for item in items:
+            start = perf_counter_ns()
+            func(item)
+            samples.append(perf_counter_ns() - start)
+    return summarize(samples)
+
+
+async def measure_async(
+    func: Callable[..., Awaitable],
+    items: Iterable,
+    repeat: int,
+    before: Callable[[], None] = None,
+) -> Dict[str, float]:
+    items = list(items)
+    samples = []
+    for _ in range(repeat):
+        for item in items:
+            if before:
+                before()
+            start = perf_counter_ns()
+            await func(item)
+            samples.append(perf_counter_ns() - start)
+    return summarize(samples)
+
+
+async def run(repeat: int = 20) -> dict:
+    payloads = fixtures.load_payloads()
+    messages, short_links = fixtures.load_messages()
+    details = [json.loads(body)["aweme_detail"] for body in payloads.values()]
+
+    await fakes.init_database(short_links)
+    fakes.serve_payloads(payloads)
+    fakes.install_client()
+
+    results = {
+        "check_for_link": measure(check_for_link, messages, repeat),
+        "find_links": measure(find_links, messages, repeat),
+        "from_dict": measure(TikTokData.from_dict, details, repeat * 50),
+        "decode_from_dict": measure(
+            lambda body: TikTokData.from_dict(tiktok.json.loads(body)["aweme_detail"]),
+            payloads.values(),
+            repeat * 50,
+        ),
+        "clean_desc": measure(
+            lambda data: clean_desc(data["text_extra"], data["desc"]),
+            details,
+            repeat * 50,
+        ),
+    }
+
+    uris = [data["video"]["play_addr"]["uri"] for data in details]
+    new_uris = iter(range(sys.maxsize))
+    results["create_short_url_new"] = await measure_async(
+        lambda uri: bot.create_short_url(f"{uri}-{next(new_uris)}"), uris, repeat
+    )
+    results["create_short_url_cached"] = await measure_async(
+        bot.create_short_url, uris, repeat * 50
+    )
+
+    events = lambda: [fakes.message_event(content) for content in messages]
+    on_message_create = bot.on_message_create.callback
+    results["on_message_create_cold"] = await measure_async(
+        on_message_create, events(), repeat, before=fakes.clear_caches
+    )
+    results["on_message_create_warm"] = await measure_async(
+        on_message_create, events(), repeat
+    )
+
+    return {
+        "meta": {
+            "commit": commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "json": tiktok.json.__name__,
+            "repeat": repeat,
+            "messages": len(messages),
+            "payloads": len(payloads),
+        },
+        "results": results,
+    }
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """Prints the change of every mean against a previous run to stderr."""
+    print(
+        f"{'benchmark':28} {'baseline us':>12} {'current us':>12} {'change':>8}",
+        file=sys.stderr,
+    )
+    for name, result in current["results"].items():
+        if not (before := baseline["results"].get(name)):
+            continue
+        change = result["mean_us"] / before["mean_us"] - 1
+        print(
+            f"{name:28} {before['mean_us']:12.2f} {result['mean_us']:12.2f} "
+            f"{change:+8.1%}",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the results to a file")
+    parser.add_argument("--compare", help="a previous results file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.repeat))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
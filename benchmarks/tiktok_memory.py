@@ -0,0 +1,171 @@
+"""
+Memory held per cached TikTokData.
+
+Fills a TikTokCache with videos parsed from synthetic aweme_detail payloads
+and reports the bytes allocated per entry, measured with tracemalloc, next to
+the size of the decoded payload the entry was built from.
+
+Usage: python -m benchmarks.tiktok_memory [ENTRIES]
+"""
+
+import gc
+import json
+import sys
+import tracemalloc
+from timeit import timeit
+
+from tiktok import TikTokCache, TikTokData
+
+
+def url_list(kind: str, video_id: int, count: int) -> list:
+    return [
+        f"https://v{16 + i}-webapp.tiktok.com/{kind}/{video_id:x}/?a=1988&br=2410"
+        "&bt=1205&cd=0%7C0%7C1&ch=0&cr=0&cs=0&cv=1&dr=0&ds=3&er=&l=2022031402341801"
+        "022307408416182D0C&lr=tiktok_m&mime_type=video_mp4&net=0&pl=0&qs=0"
+        "&rc=am5oOTY6ZnNzOzMzNzczM0ApOGk3ZDM0aDs7NzY8NmY0NmdfZ2ZmcjRnLmBgLS1kMTZzc"
+        for i in range(count)
+    ]
+
+
+def sample_aweme(index: int) -> str:
+    """An aweme_detail response body shaped like the ones api2 returns."""
+    video_id = 7068971038273423621 + index
+    handle = f"user_{index:x}"
+    tags = ["fyp", "foryou", "viral", "funny", "dance"][: index % 6]
+    desc = "wait for the end lol " + " ".join(f"#{tag}" for tag in tags)
+    text_extra = []
+    for tag in tags:
+        start = desc.index(f"#{tag}")
+        text_extra.append(
+            {
+                "start": start,
+                "end": start + len(tag) + 1,
+                "type": 1,
+                "hashtag_name": tag,
+                "hashtag_id": str(video_id),
+                "is_commerce": False,
+                "user_id": "",
+                "sec_uid": "",
+            }
+        )
+    image = lambda kind: {"uri": kind, "url_list": url_list(kind, video_id, 2)}
+    return json.dumps(
+        {
+            "aweme_detail": {
+                "aweme_id": str(video_id),
+                "desc": desc,
+                "create_time": 1646000000 + index,
+                "share_url": f"https://www.tiktok.com/@{handle}/video/{video_id}.html"
+                f"?u_code=d8ghm3h7b3l3l1&language=en&share_item_id={video_id}",
+                "text_extra": text_extra,
+                "author": {
+                    "uid": str(video_id),
+                    "nickname": f"Creator {index}",
+                    "unique_id": handle,
+                    "signature": "living my best life" * 3,
+                    "avatar_thumb": image("avatar"),
+                    "avatar_medium": image("avatar"),
+                    "sec_uid": "MS4wLjABAAAA" + "y" * 50,
+                    "follower_count": index,
+                    "region": "US",
+                },
+                "music": {
+                    "id": video_id,
+                    "title": f"original sound - {handle}",
+                    "author": f"Creator {index}",
+                    "owner_nickname": f"Creator {index}",
+                    "owner_handle": handle,
+                    "play_url": image("music"),
+                    "cover_hd": image("cover"),
+                    "cover_large": image("cover"),
+                    "cover_medium": image("cover"),
+                    "cover_thumb": image("cover"),
+                    "avatar_thumb": image("avatar"),
+                    "duration": 15,
+                },
+                "video": {
+                    "play_addr": {
+                        "uri": f"v09044g40000c8{video_id:x}",
+                        "url_list": url_list("video", video_id, 3),
+                        "data_size": 4000000 + index,
+                    },
+                    "download_addr": {
+                        "uri": "download",
+                        "url_list": url_list("download", video_id, 3),
+                    },
+                    "cover": image("cover"),
+                    "dynamic_cover": image("dynamic"),
+                    "origin_cover": image("origin"),
+                    "bit_rate": [
+                        {
+                            "gear_name": "normal_540_0",
+                            "play_addr": {"url_list": url_list("bitrate", video_id, 3)},
+                        }
+                    ],
+                    "ratio": "540p",
+                    "duration": 15000,
+                },
+                "statistics": {
+                    "aweme_id": str(video_id),
+                    "comment_count": index,
+                    "digg_count": index * 10,
+                    "download_count": index,
+                    "play_count": index * 100,
+                    "share_count": index,
+                },
+                "status": {
+                    "is_delete": False,
+                    "allow_share": True,
+                    "is_private": False,
+                },
+                "region": "US",
+                "duration": 15000,
+            },
+            "status_code": 0,
+        }
+    )
+
+
+def allocated(build, count: int) -> float:
+    """Bytes still allocated per item after building `count` items."""
+    gc.collect()
+    tracemalloc.start()
+    kept = build(count)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current / count
+
+
+def run(entries: int = 5000) -> dict:
+    bodies = [sample_aweme(index) for index in range(entries)]
+
+    def payloads(count: int) -> list:
+        return [json.loads(bodies[index])["aweme_detail"] for index in range(count)]
+
+    def cache(count: int) -> TikTokCache:
+        tiktok_cache = TikTokCache(count, ttl=3600, statistics_ttl=60)
+        for index in range(count):
+            data = json.loads(bodies[index])["aweme_detail"]
+            tiktok_cache.set(int(data["aweme_id"]), TikTokData.from_dict(data))
+        return tiktok_cache
+
+    data = json.loads(bodies[1])["aweme_detail"]
+    build = timeit(lambda: TikTokData.from_dict(data), number=10000) / 10000
+
+    return {
+        "entries": entries,
+        "payload_bytes": allocated(payloads, entries),
+        "cached_bytes": allocated(cache, entries),
+        "from_dict_us": build * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    result = run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
+    print(
+        "%(entries)d entries: %(cached_bytes).0f bytes per cached TikTokData "
+        "(decoded payload %(payload_bytes).0f bytes), "
+        "from_dict %(from_dict_us).1fus" % result
+    )
@@ -0,0 +1,244 @@
+"""
+A local stand-in for the TikTok endpoints the bot calls, for load and latency
+testing without the real hosts.
+
+- GET /aweme/v1/aweme/detail/?aweme_id=  (api2.musical.ly)
+- GET /{slug}/                           (vm.tiktok.com, redirects)
+- GET /api/music/detail/?musicId=        (tiktok.com)
+- GET /stats                             requests served per outcome
+
+Responses come from benchmarks/corpus. Every request first waits for a delay
+drawn from the latency distribution, then fails with a 429 or a 500 at the
+configured rates.
+
+Point the bot at it with:
+
+    TIKTOK_API_URL=http://127.0.0.1:8080
+    TIKTOK_WEB_URL=http://127.0.0.1:8080
+    TIKTOK_SHORT_URL=http://127.0.0.1:8080
+
+Usage: python -m benchmarks.tiktok_server [--port 8080] [--latency lognormal:80,0.5]
+       [--error-rate 0.01] [--throttle-rate 0.02] [--synthesize]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+
+from benchmarks import fixtures
+
+LATENCY_KINDS = {
+    "fixed": lambda rng, ms: ms,
+    "uniform": lambda rng, low, high: rng.uniform(low, high),
+    "exponential": lambda rng, mean: rng.expovariate(1 / mean),
+    "lognormal": lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma),
+}
+
+
+def parse_latency(spec: str, rng: random.Random) -> Callable[[], float]:
+    """
+    Parses a latency distribution like `fixed:50`, `uniform:20,200`,
+    `exponential:80` or `lognormal:80,0.5`, in milliseconds.
+
+    args:
+        spec: The distribution.
+        rng: The random source.
+
+    returns:
+        A function drawing one delay, in seconds.
+    """
+    kind, _, params = spec.partition(":")
+    if kind not in LATENCY_KINDS:
+        raise ValueError(f"Unknown latency distribution: {kind}")
+    draw = LATENCY_KINDS[kind]
+    values = [float(value) for value in params.split(",") if value]
+    return lambda: max(draw(rng, *values), 0) / 1000
+
+
+class TikTokServer:
+    """
+    Serves the corpus like the TikTok endpoints do.
+
+    With `synthesize`, unknown aweme ids are answered with a corpus payload
+    rewritten to that id, so a load test can use any number of distinct
+    videos. Otherwise they get the response of a deleted video.
+    """
+
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        error_rate: float = 0,
+        throttle_rate: float = 0,
+        synthesize: bool = False,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.rng = random.Random(seed)
+        self.latency = parse_latency(latency, self.rng)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.synthesize = synthesize
+        self.served = Counter()
+        self.payloads = fixtures.load_payloads()
+        _, self.short_links = fixtures.load_messages()
+        self._details = {
+            id: json.loads(body)["aweme_detail"] for id, body in self.payloads.items()
+        }
+        self._music = {
+            detail["music"]["id"]: detail["music"] for detail in self._details.values()
+        }
+        self._runner: Optional[web.AppRunner] = None
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._faults])
+        app.router.add_get("/aweme/v1/aweme/detail/", self.aweme_detail)
+        app.router.add_get("/api/music/detail/", self.music_detail)
+        app.router.add_get("/stats", self.stats)
+        app.router.add_get("/{slug}/", self.short_link)
+        app.router.add_get("/{slug}", self.short_link)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> str:
+        """
+        Starts serving in the running event loop.
+
+        returns:
+            The base url.
+        """
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]  # the bound port when 0 was asked
+        return f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _faults(self, request: web.Request, handler) -> web.StreamResponse:
+        if request.path == "/stats":
+            return await handler(request)
+        await asyncio.sleep(self.latency())
+        roll = self.rng.random()
+        if roll < self.throttle_rate:
+            self.served["throttled"] += 1
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        if roll < self.throttle_rate + self.error_rate:
+            self.served["error"] += 1
+            return web.Response(status=500)
+        return await handler(request)
+
+    async def aweme_detail(self, request: web.Request) -> web.Response:
+        try:
+            video_id = int(request.query.get("aweme_id", ""))
+        except ValueError:
+            self.served["bad_request"] += 1
+            return web.json_response({"status_code": 5, "status_msg": "Invalid id"})
+
+        if body := self.payloads.get(video_id):
+            self.served["aweme"] += 1
+            return web.Response(body=body, content_type="application/json")
+        if self.synthesize:
+            self.served["aweme_synthesized"] += 1
+            return web.json_response(self._synthesize(video_id))
+        self.served["aweme_deleted"] += 1
+        return web.json_response(
+            {
+                "status_code": 0,
+                "aweme_detail": None,
+                "filter_detail": {"aweme_id": str(video_id), "filter_reason": "7"},
+            }
+        )
+
+    async def short_link(self, request: web.Request) -> web.Response:
+        video_id = self.short_links.get(request.match_info["slug"])
+        if video_id is None:
+            self.served["short_link_unknown"] += 1
+            location = "https://www.tiktok.com/"
+        else:
+            self.served["short_link"] += 1
+            handle = self._details[video_id]["author"]["unique_id"]
+            location = (
+                f"https://www.tiktok.com/@{handle}/video/{video_id}"
+                "?_d=secCgYIASAHKAESPgo8&language=en&preview_pb=0&source=h5_m"
+            )
+        return web.Response(status=301, headers={"Location": location})
+
+    async def music_detail(self, request: web.Request) -> web.Response:
+        try:
+            music = self._music.get(int(request.query.get("musicId", "")))
+        except ValueError:
+            music = None
+        if music is None:
+            self.served["music_unknown"] += 1
+            return web.json_response({"statusCode": 10218, "statusMsg": ""})
+        self.served["music"] += 1
+        return web.json_response(
+            {
+                "statusCode": 0,
+                "musicInfo": {
+                    "music": {
+                        "id": str(music["id"]),
+                        "title": music["title"],
+                        "authorName": music["author"],
+                        "playUrl": music["play_url"]["url_list"][0],
+                    },
+                    "stats": {"videoCount": music["id"] % 100000},
+                },
+            }
+        )
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.served))
+
+    def _synthesize(self, video_id: int) -> Dict:
+        detail = dict(self._details[list(self._details)[video_id % len(self._details)]])
+        detail["aweme_id"] = str(video_id)
+        detail["share_url"] = (
+            f"https://www.tiktok.com/@{detail['author']['unique_id']}/video/{video_id}"
+        )
+        video = dict(detail["video"])
+        video["play_addr"] = dict(video["play_addr"], uri=f"v0{video_id}")
+        detail["video"] = video
+        return {"status_code": 0, "aweme_detail": detail}
+
+
+async def serve(args: argparse.Namespace) -> None:
+    server = TikTokServer(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        synthesize=args.synthesize,
+        seed=args.seed,
+    )
+    url = await server.start(args.host, args.port)
+    print(f"Serving {len(server.payloads)} videos on {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency", default="fixed:0", help="e.g. fixed:50, lognormal:80,0.5 (ms)"
+    )
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--synthesize", action="store_true", help="answer any aweme id")
+    parser.add_argument("--seed", type=int)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
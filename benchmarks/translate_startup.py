@@ -0,0 +1,63 @@
+"""
+Startup cost of compiling the translation catalogs.
+
+Compares the previous approach, one `python utils/msgfmt.py` process per
+language, with the in-process compiler on a cold start (no .mo files) and a
+warm start (every .po unchanged). Runs on a copy of ./locale.
+
+Usage: python -m benchmarks.translate_startup
+"""
+
+import sys
+from glob import glob
+from os import remove, system
+from shutil import copytree
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from utils.translate import compile_catalogs, languages
+
+
+def clean(locale_dir: str) -> None:
+    for file in glob(f"{locale_dir}/*/LC_MESSAGES/bot.mo*"):
+        remove(file)
+
+
+def run() -> dict:
+    with TemporaryDirectory() as directory:
+        locale_dir = f"{directory}/locale"
+        copytree("./locale", locale_dir)
+
+        clean(locale_dir)
+        start = perf_counter()
+        for language in languages:
+            system(
+                f"{sys.executable} utils/msgfmt.py "
+                f"{locale_dir}/{language}/LC_MESSAGES/bot.po"
+            )
+        subprocess = perf_counter() - start
+
+        clean(locale_dir)
+        start = perf_counter()
+        compile_catalogs(languages, locale_dir)
+        cold = perf_counter() - start
+
+        start = perf_counter()
+        compile_catalogs(languages, locale_dir)
+        warm = perf_counter() - start
+
+    return {
+        "languages": len(languages),
+        "subprocess_ms": subprocess * 1000,
+        "in_process_cold_ms": cold * 1000,
+        "in_process_warm_ms": warm * 1000,
+    }
+
+
+if __name__ == "__main__":
+    result = run()
+    print(
+        "%(languages)d languages: subprocess %(subprocess_ms).1fms, "
+        "in-process cold %(in_process_cold_ms).1fms, "
+        "warm %(in_process_warm_ms).1fms" % result
+    )
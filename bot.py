@@ -1,27 +1,53 @@
-import re
-from typing import Optional
+import asyncio
+from contextlib import suppress
+from typing import Dict, Optional, Tuple
 
-import aiohttp
 import dis_snek as dis
 from dis_snek.ext.paginators import Paginator
 from dotenv import get_key
 
 from models import *
-from tiktok import get_tiktok
+from links import check_for_link, find_links
+from embeds import config_embed, help_embeds
+from tiktok import TikTokData, get_tiktok, tiktok_cache, unavailable_videos
 
 import motor
 from beanie import init_beanie
 
-from database import Config, UsageData, Shortener, OptedOut
+from database import Config, UsageData, Shortener, OptedOut, ShortLink
+from cache import TTLCache
+from hedging import aweme_hedger
+from http_client import http_client
+from metrics import metrics
+from ratelimit import CircuitOpen, Overloaded, upstream_limiter
+from settings import get_setting
+from singleflight import SingleFlight
+from usage import usage_writer
+from optout import opted_out_index
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 from base64 import urlsafe_b64encode
-from os import urandom
+from datetime import datetime
+from hashlib import sha256
+import hmac
 
 import logging
 
 
 from utils.translate import initilized_langs as _
 from utils.translate import language_names as lang_names
+from utils.translate import compile_catalogs, languages, swap_catalogs
+
+SLUG_LENGTH = 8
+MAX_LINKS_PER_MESSAGE = get_setting("MAX_LINKS_PER_MESSAGE", 5, int)
+LINK_CONCURRENCY = get_setting("LINK_CONCURRENCY", 3, int)
+TRANSLATION_WATCH_INTERVAL = get_setting("TRANSLATION_WATCH_INTERVAL", 60, float)
+SHORTENER_KEY = get_setting("SHORTENER_KEY", "tiktoker").encode()
+WEB_URL = get_setting("TIKTOK_WEB_URL", "https://tiktok.com")
+# short links are followed as sent unless their host is overridden
+SHORT_URL = get_setting("TIKTOK_SHORT_URL")
+METRICS_PORT = get_setting("METRICS_PORT", 0, int)  # 0 disables the endpoint
 
 bot = dis.Snake(
     intents=dis.Intents.MESSAGES | dis.Intents.DEFAULT,
@@ -29,86 +55,72 @@ bot = dis.Snake(
     delete_unused_application_cmds=False,  # this is a bit buggy on restarts
 )
 
+guild_configs: Dict[int, Config] = {}
+guild_config_flights = SingleFlight()
+short_url_flights = SingleFlight()
+short_url_cache = TTLCache(get_setting("SHORT_URL_CACHE_SIZE", 4096, int))
+video_id_flights = SingleFlight()
+short_link_cache = TTLCache(get_setting("SHORT_LINK_CACHE_SIZE", 4096, int))
+failed_short_links = TTLCache(
+    1024, get_setting("SHORT_LINK_FAILURE_TTL", 60, float)
+)  # slugs that did not resolve, not retried until they expire
+catalog_watcher: Optional[asyncio.Task] = None
+
 
 @dis.listen(dis.events.Startup)
 async def on_startup():
+    global catalog_watcher
     client = motor.motor_asyncio.AsyncIOMotorClient(get_key(".env", "MONGODB_URL"))
     await init_beanie(
         database=client.tiktoker,
-        document_models=[Config, UsageData, Shortener, OptedOut],
+        document_models=[Config, UsageData, Shortener, OptedOut, ShortLink],
     )
+    await http_client.start()
+    await usage_writer.start()
+    await load_opted_out()
+    if TRANSLATION_WATCH_INTERVAL > 0 and (
+        catalog_watcher is None or catalog_watcher.done()
+    ):
+        catalog_watcher = asyncio.create_task(watch_catalogs())
+    if get_setting("PRELOAD_GUILD_CONFIGS", False, lambda v: v.lower() == "true"):
+        await preload_guild_configs()
+    if METRICS_PORT:
+        await metrics.start(
+            METRICS_PORT, get_setting("METRICS_HOST", "127.0.0.1"), diagnostics
+        )
+
+
+async def on_shutdown():
+    global catalog_watcher
+    if catalog_watcher is not None:
+        catalog_watcher.cancel()
+        with suppress(asyncio.CancelledError):
+            await catalog_watcher
+        catalog_watcher = None
+    await usage_writer.close()
+    await http_client.close()
+    await metrics.close()
+
+
+async def watch_catalogs():
+    """Recompiles changed .po files and swaps their catalogs in while running."""
+    while True:
+        await asyncio.sleep(TRANSLATION_WATCH_INTERVAL)
+        try:
+            compiled = await asyncio.to_thread(compile_catalogs, languages)
+        except Exception as e:
+            print(f"Error: unable to reload translations: {e}")
+            continue
+        if compiled:
+            swap_catalogs(compiled)
+            print(f"Reloaded translations: {', '.join(compiled)}")
 
 
 @dis.slash_command("help", "All the help you need")
 async def help(ctx: dis.InteractionContext):
     config = await get_guild_config(ctx.guild.id)
     print(config.language)
-    embeds = [
-        dis.Embed(
-            title=_[config.language].gettext("What is TikToker?"),
-            description=_[config.language].gettext(
-                "Tiktoker is a bot that allows you to send playable TikTok videos to your Discord server."
-            ),
-            color="#00FFF0",
-            fields=[
-                dis.EmbedField(
-                    _[config.language].gettext("Help Menu"),
-                    _[config.language].gettext(
-                        "Click the arrow buttons below to navigate the help menu."
-                    ),
-                ).to_dict(),
-            ],
-        ),
-        dis.Embed(
-            _[config.language].gettext("Server Configuration"),
-            _[config.language].gettext(
-                "You may view the configuration of your server with `/config`.\nTo edit the config use, `/config <option>`.\nExample: `/config delete_origin:True`"
-            ),
-            color="#00FFF0",
-            fields=[
-                dis.EmbedField(
-                    "Auto Embed",
-                    _[config.language].gettext(
-                        "If enabled, the bot will automatically embed the Tiktok links."
-                    ),
-                ).to_dict(),
-                dis.EmbedField(
-                    "Delete Origin",
-                    _[config.language].gettext(
-                        "If enabled and _Auto Embed_ is enabled, the bot will delete the origin message containing the TikTok link."
-                    ),
-                ).to_dict(),
-                dis.EmbedField(
-                    "Suppress Origin Embed",
-                    _[config.language].gettext(
-                        "If enabled, the origin embed will be removed."
-                    ),
-                ).to_dict(),
-            ],
-        ),
-        dis.Embed(
-            _[config.language].gettext("Commands"),
-            _[config.language].gettext(
-                "Here are some commands to interact with the bot."
-            ),
-            color="#00FFF0",
-            fields=[
-                dis.EmbedField(
-                    "Convert 📸",
-                    _[config.language].gettext(
-                        "To use, right-click a message, go to `Apps > Convert %s`. Useful for when _Auto Embed_ is disabled in your server's configuration."
-                    )
-                    % "📸",
-                ).to_dict(),
-                dis.EmbedField(
-                    "/tiktok",
-                    _[config.language].gettext(
-                        "A slash command that takes a TikTok link and returns the video. Useful for when _Auto Embed_ is disabled in your server's configuration."
-                    ),
-                ).to_dict(),
-            ],
-        ),
-    ]
+    embeds = help_embeds[config.language]
 
     paginator = Paginator.create_from_embeds(bot, *embeds, timeout=20)
     paginator.default_button_color = dis.ButtonStyles.GRAY
@@ -154,7 +166,7 @@ async def privacy_options(ctx: dis.InteractionContext, collect: str = None):
     if collect is None:
         state = (
             _[config.language].gettext("Opted-out")
-            if await get_opted_out(ctx.author.id)
+            if get_opted_out(ctx.author.id)
             else _[config.language].gettext("Opted-in")
         )
         await ctx.send(
@@ -244,51 +256,20 @@ async def setup_config(
         and suppress_origin_embed is None
         and language is None
     ):
-        embed = dis.Embed(
-            _[config.language].gettext("Current Config"),
-            _[config.language].gettext(
-                "To change a setting, use `/config <setting> <value>`."
-            ),
-        )
-        embed.add_field("Auto Embed", "☑️" if config.auto_embed else "❌", inline=True)
-        embed.add_field(
-            "Delete Origin", "☑️" if config.delete_origin else "❌", inline=True
-        )
-        embed.add_field(
-            "Suppress Origin Embed",
-            "☑️" if config.suppress_origin_embed else "❌",
-            inline=True,
-        )
-        embed.add_field("Language", config.language, inline=True)
-        await ctx.send(embed=embed)
+        await ctx.send(embed=config_embed(config))
         return
 
-    if auto_embed is not None:
-        config.auto_embed = auto_embed
-    if delete_origin is not None:
-        config.delete_origin = delete_origin
-    if suppress_origin_embed is not None:
-        config.suppress_origin_embed = suppress_origin_embed
-    if language is not None:
-        config.language = language
-
-    await config.save()
-
-    embed = dis.Embed(
-        _[config.language].gettext("Current Config"),
-        _[config.language].gettext(
-            "To change a setting, use `/config <setting> <value>`."
-        ),
-    )
-    embed.add_field("Auto Embed", "☑️" if config.auto_embed else "❌", inline=True)
-    embed.add_field("Delete Origin", "☑️" if config.delete_origin else "❌", inline=True)
-    embed.add_field(
-        "Suppress Origin Embed",
-        "☑️" if config.suppress_origin_embed else "❌",
-        inline=True,
+    options = {
+        "auto_embed": auto_embed,
+        "delete_origin": delete_origin,
+        "suppress_origin_embed": suppress_origin_embed,
+        "language": language,
+    }
+    config = await edit_guild_config(
+        guild_id, **{key: value for key, value in options.items() if value is not None}
     )
-    embed.add_field("Language", config.language, inline=True)
-    await ctx.send(embed=embed)
+
+    await ctx.send(embed=config_embed(config))
 
 
 @dis.context_menu("Convert 📸", dis.CommandTypes.MESSAGE)
@@ -303,14 +284,14 @@ async def menu_convert_video(ctx: dis.InteractionContext):
         )
         return
 
-    if link.type == VideoIdType.SHORT:
-        video_id = await get_video_id(link.url)
-    else:
-        video_id = link.id
-
     try:
+        if link.type == VideoIdType.SHORT:
+            video_id = await get_video_id(link)
+        else:
+            video_id = link.id
+
         tiktok = await get_tiktok(video_id)
-    except Exception as e:
+    except Exception as e:  # Overloaded too, e.g. an open circuit
         await ctx.send(f"Error: {e}", ephemeral=True)
         return
 
@@ -332,6 +313,7 @@ async def menu_convert_video(ctx: dis.InteractionContext):
 
     too_big = False
     if tiktok.video.size > 50000000:
+        metrics.count("too_big")
         too_big = _[config.language].gettext(
             "This video may be too long/big for Discord to embed. Just visit the link above."
         )
@@ -356,14 +338,14 @@ async def slash_tiktok(ctx: dis.InteractionContext, link: str):
         )
         return
 
-    if link.type == VideoIdType.SHORT:
-        video_id = await get_video_id(link.url)
-    else:
-        video_id = link.id
-
     try:
+        if link.type == VideoIdType.SHORT:
+            video_id = await get_video_id(link)
+        else:
+            video_id = link.id
+
         tiktok = await get_tiktok(video_id)
-    except Exception as e:
+    except Exception as e:  # Overloaded too, e.g. an open circuit
         await ctx.send(f"Error: {e}", ephemeral=True)
         return
 
@@ -381,6 +363,7 @@ async def slash_tiktok(ctx: dis.InteractionContext, link: str):
     )
     too_big = False
     if tiktok.video.size > 50000000:
+        metrics.count("too_big")
         too_big = _[config.language].gettext(
             "This video may be too long/big for Discord to embed. Just visit the link above."
         )
@@ -394,8 +377,9 @@ async def on_message_create(event: dis.events.MessageCreate):
     if event.message.author.id == bot.user.id:
         return
     content = event.message.content
-    link = check_for_link(content)
-    if not link:
+    with metrics.timer("link_scan"):
+        links = find_links(content, MAX_LINKS_PER_MESSAGE)
+    if not links:
         return
 
     config = await get_guild_config(event.message.guild.id)
@@ -403,68 +387,104 @@ async def on_message_create(event: dis.events.MessageCreate):
     if not config.auto_embed:
         return
 
-    if link.type == VideoIdType.SHORT:
-        video_id = await get_video_id(link.url)
-    else:
-        video_id = link.id
-
-    try:
-        tiktok = await get_tiktok(video_id)
-    except Exception as e:
-        print(f"Error: {e}")
+    semaphore = asyncio.Semaphore(LINK_CONCURRENCY)
+    conversions = {}  # one per video, in message order
+    for conversion in await asyncio.gather(
+        *[convert_link(link, semaphore) for link in links]
+    ):
+        if conversion:
+            conversions.setdefault(int(conversion[0]), conversion)
+    if not conversions:
         return
 
-    short_url = await create_short_url(tiktok.video.video_uri)
-
-    more_info_btn = dis.Button(
-        dis.ButtonStyles.GRAY,
-        "Info",
-        "🌐",
-        custom_id=f"v_id{video_id}",
-    )
-    delete_msg_btn = dis.Button(
-        dis.ButtonStyles.RED,
-        emoji="🗑️",
-        custom_id=f"delete{event.message.author.id}",
+    short_url = "\n".join(short_url for _, _, short_url in conversions.values())
+    components = [
+        dis.Button(
+            dis.ButtonStyles.GRAY,
+            "Info" if len(conversions) == 1 else f"Info {number}",
+            "🌐",
+            custom_id=f"v_id{video_id}",
+        )
+        for number, video_id in enumerate(conversions, 1)
+    ]
+    components.append(
+        dis.Button(
+            dis.ButtonStyles.RED,
+            emoji="🗑️",
+            custom_id=f"delete{event.message.author.id}",
+        )
     )
+    components = dis.spread_to_rows(*components)
     too_big = False
-    if tiktok.video.size > 50000000:  # 50mb | This is Discord's limit for embeds
+    # 50mb | This is Discord's limit for embeds
+    if big := sum(
+        tiktok.video.size > 50000000 for _, tiktok, _ in conversions.values()
+    ):
+        metrics.count("too_big", big)
         too_big = _[config.language].gettext(
             "This video may be too long/big for Discord to embed. Just visit the link above."
         )
 
-    if config.delete_origin:
-        message = _[config.language].gettext("%s | From: %s %s") % (
-            short_url,
-            event.message.author.mention,
-            "\n" + too_big if too_big else "",
-        )
-        sent_msg = await event.message.channel.send(
-            message,
-            components=[more_info_btn, delete_msg_btn],
-            allowed_mentions=dis.AllowedMentions.none(),
+    with metrics.timer("discord_send"):
+        if config.delete_origin:
+            message = _[config.language].gettext("%s | From: %s %s") % (
+                short_url,
+                event.message.author.mention,
+                "\n" + too_big if too_big else "",
+            )
+            sent_msg = await event.message.channel.send(
+                message,
+                components=components,
+                allowed_mentions=dis.AllowedMentions.none(),
+            )
+            try:
+                await event.message.delete()
+            except dis.errors.NotFound:
+                pass
+        elif config.suppress_origin_embed:
+            await event.message.suppress_embeds()
+            await bot.fetch_channel(event.message._channel_id)
+            message = short_url + ("\n" + too_big if too_big else "")
+            sent_msg = await event.message.reply(message, components=components)
+        else:
+            await bot.fetch_channel(event.message._channel_id)
+            message = short_url + ("\n" + too_big if too_big else "")
+            sent_msg = await event.message.reply(message, components=components)
+    metrics.count("converted", len(conversions))
+
+    for video_id in conversions:
+        await insert_usage_data(
+            event.message.guild.id, event.message.author.id, video_id, sent_msg.id
         )
+
+
+async def convert_link(
+    link: "LinkData", semaphore: asyncio.Semaphore
+) -> Optional[Tuple[int, "TikTokData", str]]:
+    """
+    Resolves, fetches and shortens one link.
+
+    args:
+        link: The link to convert.
+        semaphore: Caps how many links of a message are converted at once.
+
+    returns:
+        The video id, the TikTok and its short url, or None on an error.
+    """
+    async with semaphore:
         try:
-            await event.message.delete()
-        except dis.errors.NotFound:
-            pass
-    elif config.suppress_origin_embed:
-        await event.message.suppress_embeds()
-        await bot.fetch_channel(event.message._channel_id)
-        message = short_url + ("\n" + too_big if too_big else "")
-        sent_msg = await event.message.reply(
-            message, components=[more_info_btn, delete_msg_btn]
-        )
-    else:
-        await bot.fetch_channel(event.message._channel_id)
-        message = short_url + ("\n" + too_big if too_big else "")
-        sent_msg = await event.message.reply(
-            message, components=[more_info_btn, delete_msg_btn]
-        )
+            if link.type == VideoIdType.SHORT:
+                video_id = await get_video_id(link)
+            else:
+                video_id = link.id
 
-    await insert_usage_data(
-        event.message.guild.id, event.message.author.id, video_id, sent_msg.id
-    )
+            tiktok = await get_tiktok(video_id, shed=True)
+            return video_id, tiktok, await create_short_url(tiktok.video.video_uri)
+        except Overloaded:
+            return None  # auto-embeds are dropped while upstream is saturated
+        except Exception as e:
+            print(f"Error: {e}")
+            return None
 
 
 @dis.listen(dis.events.Button)
@@ -487,7 +507,16 @@ async def on_button_click(event: dis.events.Button):
             )
     elif ctx.custom_id.startswith("v_id"):
         await ctx.defer(ephemeral=True)
-        tiktok = await get_tiktok(int(ctx.custom_id[4:]))
+        try:
+            tiktok = await get_tiktok(int(ctx.custom_id[4:]), statistics=True)
+        except Exception as e:
+            await ctx.send(
+                _[config.language].gettext(
+                    "It seems this video is deleted or taken down."
+                )
+            )
+            print(f"Error: {e}")
+            return
 
         video = tiktok.video
         author = tiktok.author
@@ -593,6 +622,7 @@ async def on_button_click(event: dis.events.Button):
         )
 
 
+@metrics.timed("shortener")
 async def create_short_url(video_uri: str) -> str:
     """
     Shortens a url if not in cache.
@@ -603,36 +633,96 @@ async def create_short_url(video_uri: str) -> str:
     returns:
         The shortened url.
     """
+    if shortened_url := short_url_cache.get(video_uri):
+        return shortened_url
+    return await short_url_flights.do(video_uri, _create_short_url, video_uri)
 
-    if existing_entry := await Shortener.find_one({"video_uri": video_uri}):
-        return existing_entry.shortened_url
 
-    slug = urlsafe_b64encode(urandom(6)).decode()
-    while len(await Shortener.find({"slug": slug}).to_list()) > 0:
-        print("Note: slug collision, regenerating")
-        slug = urlsafe_b64encode(urandom(6)).decode()
+async def _create_short_url(video_uri: str) -> str:
+    collection = Shortener.get_motor_collection()
+    # the slug grows on a collision with another video's slug
+    for length in range(SLUG_LENGTH, 43, 2):
+        slug = make_slug(video_uri, length)
+        try:
+            document = await collection.find_one_and_update(
+                {"video_uri": video_uri},
+                {
+                    "$setOnInsert": {
+                        "slug": slug,
+                        "shortened_url": f"https://m.tiktoker.win/{slug}",
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            print("Note: slug collision, extending")
+            continue
+        short_url_cache.set(video_uri, document["shortened_url"])
+        return document["shortened_url"]
+    raise ValueError("Unable to create a short url")
 
-    shortener = Shortener(
-        video_uri=video_uri,
-        slug=slug,
-        shortened_url=f"https://m.tiktoker.win/{slug}",
-    )
-    await shortener.insert()
-    return shortener.shortened_url
+
+def make_slug(video_uri: str, length: int = SLUG_LENGTH) -> str:
+    """
+    Derives a slug from the video uri with a keyed hash.
+
+    args:
+        video_uri: The uri of the video.
+        length: The number of characters in the slug.
+
+    returns:
+        The slug.
+    """
+    digest = hmac.new(SHORTENER_KEY, video_uri.encode(), sha256).digest()
+    return urlsafe_b64encode(digest).decode()[:length]
 
 
-async def get_video_id(url: str) -> int:
+@metrics.timed("short_link_resolve")
+async def get_video_id(link: "LinkData") -> Optional[int]:
     """
     Gets the video id from short url.
 
+    A slug always maps to the same video, so it is resolved over the network
+    once and then served from memory or the ShortLink collection.
+
     args:
-        url: The url to get the id from.
+        link: The short link to get the id from.
 
     returns:
         The video id.
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, allow_redirects=False) as response:
+    if video_id := short_link_cache.get(link.id):
+        return video_id
+    if failed_short_links.get(link.id):
+        return None
+    return await video_id_flights.do(link.id, _resolve_video_id, link)
+
+
+async def _resolve_video_id(link: "LinkData") -> Optional[int]:
+    if short_link := await ShortLink.find_one({"slug": link.id}):
+        short_link_cache.set(link.id, short_link.video_id)
+        return short_link.video_id
+
+    url = f"{SHORT_URL}/{link.id}/" if SHORT_URL else link.url
+    if (video_id := await _follow_short_link(url)) is None:
+        metrics.count("short_link_unresolved")
+        failed_short_links.set(link.id, True)
+        return None
+
+    video_id = int(video_id)
+    short_link_cache.set(link.id, video_id)
+    try:
+        await ShortLink(slug=link.id, video_id=video_id).insert()
+    except DuplicateKeyError:
+        pass  # resolved concurrently by another process
+    return video_id
+
+
+async def _follow_short_link(url: str) -> Optional[str]:
+    async with upstream_limiter.slot(url, endpoint="short_link") as call:
+        async with http_client.session.get(url, allow_redirects=False) as response:
+            call.ok = response.status < 500 and response.status != 429
             if location := response.headers.get("Location"):
                 if link := check_for_link(location):
                     return link.id
@@ -648,133 +738,85 @@ async def get_music_data(music_id: int = None) -> Optional[dict]:
     returns:
         The music data.
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"https://tiktok.com/api/music/detail/?language=en&musicId={music_id}",
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:97.0) Gecko/20100101 Firefox/97.0"
-            },
-        ) as response:
-            if response.status == 200:
-                if data := await response.json():
-                    if data.get("statusCode") == 10218:
-                        return None
+    url = f"{WEB_URL}/api/music/detail/?language=en&musicId={music_id}"
+    try:
+        async with upstream_limiter.slot(url, endpoint="music_detail") as call:
+            async with http_client.session.get(
+                url,
+                headers={
+                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:97.0) Gecko/20100101 Firefox/97.0"
+                },
+            ) as response:
+                call.ok = response.status < 500 and response.status != 429
+                if response.status == 200:
+                    if data := await response.json():
+                        if data.get("statusCode") == 10218:
+                            return None
+                        return data
                     return data
-                return data
-            else:
-                return None
+                else:
+                    return None
+    except CircuitOpen:
+        return None  # the video count is optional
 
 
-def check_for_link(content: str) -> Optional["LinkData"]:
+async def get_guild_config(guild_id: int) -> "Config":
     """
-    Checks if the content has a TikTok video.
+    Gets the guild config.
 
     args:
-        content: The content to check.
+        guild_id: The guild id.
 
     returns:
-        LinkData
+        The guild config.
     """
-    try:
-        fyp_match = re.search(
-            r"(?P<http>http:|https:\/\/)?(www)?\.tiktok.com\/(.*)item_id=(?P<item_id>\d{5,30})",
-            content,
-        )
-        long_match = re.search(
-            r"(?P<http>http:|https:\/\/)?(www\.)?tiktok\.com\/(@.{1,24})\/video\/(?P<id>\d{15,30})",
-            content,
-        )
-        short_match = re.search(
-            r"(?P<http>http:|https:\/\/)?((?!ww)\w{2})\.tiktok.com\/(?P<short_id>\w{5,15})",
-            content,
-        )
-        medium_match = re.search(
-            r"(?P<http>http:|https:\/\/)?m\.tiktok\.com\/v\/(?P<id>\d{15,30})", content
-        )
-    except TypeError as e:
-        print(f"{content} is not a string")
-        print(type(content))
-    if long_match:
-        if not long_match.group("http"):
-            return LinkData.from_list(
-                [
-                    VideoIdType.LONG,
-                    long_match.group("id"),
-                    f"https://{long_match.group(0)}",
-                ]
-            )
-        return LinkData.from_list(
-            [VideoIdType.LONG, long_match.group("id"), long_match.group(0)]
-        )
-    if short_match:
-        if not short_match.group("http"):
-            return LinkData.from_list(
-                [
-                    VideoIdType.SHORT,
-                    short_match.group("short_id"),
-                    f"https://{short_match.group(0)}",
-                ]
-            )
-        return LinkData.from_list(
-            [VideoIdType.SHORT, short_match.group("short_id"), short_match.group(0)]
-        )
-    if medium_match:
-        if not medium_match.group("http"):
-            return LinkData.from_list(
-                [
-                    VideoIdType.MEDIUM,
-                    medium_match.group("id"),
-                    f"https://{medium_match.group(0)}",
-                ]
-            )
-        return LinkData.from_list(
-            [VideoIdType.MEDIUM, medium_match.group("id"), medium_match.group(0)]
-        )
-    if fyp_match:
-        if not fyp_match.group("http"):
-            return LinkData.from_list(
-                [
-                    VideoIdType.FYP,
-                    fyp_match.group("item_id"),
-                    f"https://{fyp_match.group(0)}",
-                ]
-            )
-        return LinkData.from_list(
-            [VideoIdType.FYP, fyp_match.group("item_id"), fyp_match.group(0)]
-        )
-    return None
+    if config := guild_configs.get(guild_id):
+        return config
+    return await guild_config_flights.do(guild_id, _load_guild_config, guild_id)
 
 
-async def get_guild_config(guild_id: int) -> "Config":
+async def _load_guild_config(guild_id: int) -> "Config":
+    # a single upsert, so two first messages from a new guild can't race
+    document = await Config.get_motor_collection().find_one_and_update(
+        {"guild_id": guild_id},
+        {"$setOnInsert": Config(guild_id=guild_id).dict(exclude={"id", "revision_id"})},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    config = Config.parse_obj(document)
+    guild_configs[guild_id] = config
+    return config
+
+
+async def preload_guild_configs() -> None:
+    """Loads every guild config into memory."""
+    async for config in Config.find_all():
+        guild_configs[config.guild_id] = config
+
+
+async def edit_guild_config(guild_id: int, **kwargs) -> "Config":
     """
-    Gets the guild config.
+    Edits the guild config, writing through to the cache.
 
     args:
         guild_id: The guild id.
+        kwargs: The settings to change.
 
     returns:
-        The guild config.
+        The updated guild config.
     """
-    if config := await Config.find_one({"guild_id": guild_id}):
-        return config
-    else:
-        new_config = Config(guild_id=guild_id)
-        await new_config.insert()
-        return new_config
-
-
-async def edit_guild_config(guild_id: int, **kwargs) -> "Config":
-    config = await get_guild_config(guild_id)
-    for key, value in kwargs.items():
-        await config.update({key: value})
-    return await get_guild_config(guild_id)
+    config = (await get_guild_config(guild_id)).copy(update=kwargs)
+    await config.save()  # the cached config stays as it was if this fails
+    guild_configs[guild_id] = config
+    return config
 
 
+@metrics.timed("usage_insert")
 async def insert_usage_data(
     guild_id: int, user_id: int, video_id: int, message_id: int
 ) -> None:
     """
-    Inserts usage data.
+    Queues usage data, it is written in batches by the usage writer.
 
     args:
         guild_id: The guild id.
@@ -783,21 +825,32 @@ async def insert_usage_data(
         message_id: The message id with the video.
     """
 
-    if await get_opted_out(user_id):  # weirdos
+    if get_opted_out(user_id):  # weirdos
         user_id = None
         message_id = None
 
-    await UsageData(
-        guild_id=guild_id, user_id=user_id, video_id=video_id, message_id=message_id
-    ).insert()
+    usage_writer.submit(
+        UsageData(
+            guild_id=guild_id,
+            user_id=user_id,
+            video_id=video_id,
+            message_id=message_id,
+            timestamp=int(datetime.now().timestamp()),
+        )
+    )
 
 
 async def add_opted_out(user_id: int) -> None:
-    await OptedOut(user_id=user_id).insert()
+    try:
+        await OptedOut(user_id=user_id).insert()
+    except DuplicateKeyError:
+        pass  # already opted out
+    opted_out_index.add(user_id)
 
 
 async def remove_opted_out(user_id: int) -> None:
     await OptedOut.find({"user_id": user_id}).delete()
+    opted_out_index.remove(user_id)
 
 
 async def remove_usage_data(guild_id: int, user_id: int) -> None:
@@ -805,11 +858,51 @@ async def remove_usage_data(guild_id: int, user_id: int) -> None:
     await usage_data.update_many().set({"message_id": None, "user_id": None})
 
 
-async def get_opted_out(user_id: int) -> bool:
-    if opted_out := await OptedOut.find_one({"user_id": user_id}):
-        return True
-    else:
-        return False
+def get_opted_out(user_id: int) -> bool:
+    return user_id in opted_out_index
+
+
+async def load_opted_out() -> None:
+    """Loads every opted out user id into memory."""
+    cursor = OptedOut.get_motor_collection().find({}, {"user_id": 1, "_id": 0})
+    opted_out_index.load([document["user_id"] async for document in cursor])
+    print(
+        "Loaded %d opted out users (%d bytes)"
+        % (len(opted_out_index), opted_out_index.memory_usage())
+    )
+
 
+def diagnostics() -> dict:
+    """
+    Collects the state of the in-memory caches.
 
-bot.start(get_key(".env", "TOKEN"))
+    returns:
+        Stats per subsystem.
+    """
+    return {
+        "tiktok_cache": tiktok_cache.stats(),
+        "short_link_cache": short_link_cache.stats(),
+        "short_url_cache": short_url_cache.stats(),
+        "guild_configs": {"size": len(guild_configs)},
+        "opted_out": opted_out_index.stats(),
+        "usage_writer": usage_writer.stats(),
+        "translations": _.stats(),
+        "unavailable_videos": unavailable_videos.stats(),
+        "upstream": upstream_limiter.stats(),
+        "circuits": upstream_limiter.circuit_stats(),
+        "aweme_hedging": aweme_hedger.stats(),
+    }
+
+
+async def main():
+    try:
+        await bot.astart(get_key(".env", "TOKEN"))
+    finally:
+        await on_shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -28,3 +28,8 @@ class Shortener(Document, dis.DictSerializationMixin):
 
 class OptedOut(Document):
     user_id: Indexed(int, unique=True)
+
+
+class ShortLink(Document):
+    slug: Indexed(str, unique=True)
+    video_id: int
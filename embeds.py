@@ -0,0 +1,144 @@
+from gettext import GNUTranslations
+from typing import Any, Callable, Dict, List, Tuple
+
+import dis_snek as dis
+
+from database import Config
+
+from utils.translate import initilized_langs as _
+
+
+class RenderCache:
+    """
+    Localized content rendered once per language.
+
+    An entry is rebuilt when the language's catalog object changes, i.e. once
+    per catalog load.
+
+    args:
+        render: Builds the content from a catalog.
+    """
+
+    def __init__(self, render: Callable[[GNUTranslations], Any]) -> None:
+        self._render = render
+        self._rendered: Dict[str, Tuple[GNUTranslations, Any]] = {}
+
+    def __getitem__(self, language: str) -> Any:
+        catalog = _[language]
+        entry = self._rendered.get(language)
+        if entry is None or entry[0] is not catalog:
+            entry = (catalog, self._render(catalog))
+            self._rendered[language] = entry
+        return entry[1]
+
+    def clear(self) -> None:
+        self._rendered.clear()
+
+
+def render_help(catalog: GNUTranslations) -> List[dis.Embed]:
+    return [
+        dis.Embed(
+            title=catalog.gettext("What is TikToker?"),
+            description=catalog.gettext(
+                "Tiktoker is a bot that allows you to send playable TikTok videos to your Discord server."
+            ),
+            color="#00FFF0",
+            fields=[
+                dis.EmbedField(
+                    catalog.gettext("Help Menu"),
+                    catalog.gettext(
+                        "Click the arrow buttons below to navigate the help menu."
+                    ),
+                ).to_dict(),
+            ],
+        ),
+        dis.Embed(
+            catalog.gettext("Server Configuration"),
+            catalog.gettext(
+                "You may view the configuration of your server with `/config`.\nTo edit the config use, `/config <option>`.\nExample: `/config delete_origin:True`"
+            ),
+            color="#00FFF0",
+            fields=[
+                dis.EmbedField(
+                    "Auto Embed",
+                    catalog.gettext(
+                        "If enabled, the bot will automatically embed the Tiktok links."
+                    ),
+                ).to_dict(),
+                dis.EmbedField(
+                    "Delete Origin",
+                    catalog.gettext(
+                        "If enabled and _Auto Embed_ is enabled, the bot will delete the origin message containing the TikTok link."
+                    ),
+                ).to_dict(),
+                dis.EmbedField(
+                    "Suppress Origin Embed",
+                    catalog.gettext("If enabled, the origin embed will be removed."),
+                ).to_dict(),
+            ],
+        ),
+        dis.Embed(
+            catalog.gettext("Commands"),
+            catalog.gettext("Here are some commands to interact with the bot."),
+            color="#00FFF0",
+            fields=[
+                dis.EmbedField(
+                    "Convert 📸",
+                    catalog.gettext(
+                        "To use, right-click a message, go to `Apps > Convert %s`. Useful for when _Auto Embed_ is disabled in your server's configuration."
+                    )
+                    % "📸",
+                ).to_dict(),
+                dis.EmbedField(
+                    "/tiktok",
+                    catalog.gettext(
+                        "A slash command that takes a TikTok link and returns the video. Useful for when _Auto Embed_ is disabled in your server's configuration."
+                    ),
+                ).to_dict(),
+            ],
+        ),
+    ]
+
+
+def render_config(catalog: GNUTranslations) -> dict:
+    return dis.Embed(
+        catalog.gettext("Current Config"),
+        catalog.gettext("To change a setting, use `/config <setting> <value>`."),
+    ).to_dict()
+
+
+help_embeds = RenderCache(render_help)
+config_embeds = RenderCache(render_config)
+
+CHECKBOX_FIELDS = {
+    key: {
+        True: dis.EmbedField(name, "☑️", inline=True).to_dict(),
+        False: dis.EmbedField(name, "❌", inline=True).to_dict(),
+    }
+    for key, name in {
+        "auto_embed": "Auto Embed",
+        "delete_origin": "Delete Origin",
+        "suppress_origin_embed": "Suppress Origin Embed",
+    }.items()
+}
+
+
+def config_embed(config: Config) -> dict:
+    """
+    Fills the guild's settings into the pre-rendered config embed.
+
+    args:
+        config: The guild config.
+
+    returns:
+        The embed as a dict.
+    """
+    return dict(
+        config_embeds[config.language],
+        fields=[
+            CHECKBOX_FIELDS["auto_embed"][config.auto_embed],
+            CHECKBOX_FIELDS["delete_origin"][config.delete_origin],
+            CHECKBOX_FIELDS["suppress_origin_embed"][config.suppress_origin_embed],
+            {"name": "Language", "value": config.language, "inline": True},
+        ],
+    )
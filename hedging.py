@@ -0,0 +1,179 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+from metrics import metrics
+from settings import get_setting
+
+T = TypeVar("T")
+
+
+class LatencyWindow:
+    """
+    The latencies of the last `size` successful requests.
+
+    Quantiles are recomputed every `refresh` samples rather than on every
+    read, so a request doesn't pay for sorting the whole window.
+    """
+
+    def __init__(self, size: int = 500, min_samples: int = 20, refresh: int = 25):
+        self.min_samples = min_samples
+        self.refresh = refresh
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._sorted: List[float] = []
+        self._stale = 0
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._stale += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        args:
+            q: The quantile, between 0 and 1.
+
+        returns:
+            The latency in seconds, None until `min_samples` were added.
+        """
+        if len(self._samples) < self.min_samples:
+            return None
+        if self._stale >= self.refresh or not self._sorted:
+            self._sorted = sorted(self._samples)
+            self._stale = 0
+        return self._sorted[min(len(self._sorted) - 1, int(len(self._sorted) * q))]
+
+
+class Hedger:
+    """
+    Hedged requests and adaptive timeouts for one endpoint.
+
+    A request still unanswered after the observed p95 gets a second, hedged
+    request, and whichever answers first wins. Hedges are paid for from a
+    budget that earns `budget` hedges per request, so at most that share of
+    the traffic is hedged. Timeouts are `timeout_multiplier` times the
+    observed p99, within `min_timeout` and `max_timeout`.
+
+    Until enough latencies were observed there is no hedging and the timeout
+    is `max_timeout`.
+    """
+
+    def __init__(
+        self,
+        budget: float = 0.05,
+        min_delay: float = 0.05,
+        min_timeout: float = 1,
+        max_timeout: float = 5,
+        timeout_multiplier: float = 3,
+        max_credit: float = 10,
+    ) -> None:
+        self.budget = budget
+        self.min_delay = min_delay
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.max_credit = max_credit
+        self.latencies = LatencyWindow()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._credit = 0.0
+
+    @classmethod
+    def from_settings(cls) -> "Hedger":
+        """
+        Creates a hedger configured from the .env file.
+
+        returns:
+            A Hedger.
+        """
+        return cls(
+            budget=get_setting("HEDGE_BUDGET", 0.05, float),
+            min_delay=get_setting("HEDGE_MIN_DELAY", 0.05, float),
+            min_timeout=get_setting("UPSTREAM_MIN_TIMEOUT", 1, float),
+            max_timeout=get_setting("UPSTREAM_MAX_TIMEOUT", 5, float),
+            timeout_multiplier=get_setting("UPSTREAM_TIMEOUT_MULTIPLIER", 3, float),
+        )
+
+    def observe(self, seconds: float) -> None:
+        """Records the latency of a successful request."""
+        self.latencies.add(seconds)
+
+    def timeout(self) -> float:
+        if (p99 := self.latencies.quantile(0.99)) is None:
+            return self.max_timeout
+        return min(
+            max(p99 * self.timeout_multiplier, self.min_timeout), self.max_timeout
+        )
+
+    def delay(self) -> Optional[float]:
+        """
+        returns:
+            How long to wait before hedging, None while there is no p95 yet.
+        """
+        if (p95 := self.latencies.quantile(0.95)) is None:
+            return None
+        return max(p95, self.min_delay)
+
+    async def run(self, attempt: Callable[[bool], Awaitable[T]]) -> T:
+        """
+        Runs a request, hedged if it is slow and the budget allows.
+
+        The first answer wins and the other request is cancelled. When both
+        fail, the error of the first request is raised.
+
+        args:
+            attempt: Starts one request, its argument tells whether it is the
+                hedge.
+
+        returns:
+            The first answer.
+        """
+        self.requests += 1
+        self._credit = min(self._credit + self.budget, self.max_credit)
+        attempts = [asyncio.ensure_future(attempt(False))]
+        try:
+            delay = self.delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done and self._credit >= 1:
+                    self._credit -= 1
+                    self.hedged += 1
+                    metrics.count("hedged")
+                    attempts.append(asyncio.ensure_future(attempt(True)))
+
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not attempts[0]:
+                            self.hedge_wins += 1
+                            metrics.count("hedge_won")
+                        return task.result()
+            raise attempts[0].exception()
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()  # retrieved, a lost hedge is not an error
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "samples": len(self.latencies),
+            "p50": self.latencies.quantile(0.5) or 0,
+            "p95": self.latencies.quantile(0.95) or 0,
+            "p99": self.latencies.quantile(0.99) or 0,
+            "timeout": self.timeout(),
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+aweme_hedger = Hedger.from_settings()
@@ -0,0 +1,70 @@
+from typing import Optional
+
+import aiohttp
+
+from settings import get_setting
+
+
+class HTTPClient:
+    """
+    A long-lived, pooled HTTP client shared by all TikTok API traffic.
+
+    Connections are kept alive and pooled per host, and DNS lookups are
+    cached, so repeat requests to the same host skip the TCP+TLS handshake.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    def from_settings(cls) -> "HTTPClient":
+        """
+        Creates a client configured from the .env file.
+
+        returns:
+            An HTTPClient.
+        """
+        return cls(
+            limit=get_setting("HTTP_POOL_LIMIT", 100, int),
+            limit_per_host=get_setting("HTTP_POOL_LIMIT_PER_HOST", 20, int),
+            dns_cache_ttl=get_setting("HTTP_DNS_CACHE_TTL", 300, int),
+            keepalive_timeout=get_setting("HTTP_KEEPALIVE_TIMEOUT", 30, float),
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HTTP client is not started")
+        return self._session
+
+    async def start(self) -> None:
+        """Opens the underlying session. Safe to call more than once."""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self) -> None:
+        """Closes the session and every pooled connection."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_client = HTTPClient.from_settings()
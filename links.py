@@ -0,0 +1,178 @@
+import re
+from typing import Dict, List, Optional
+
+from models import LinkData, VideoIdType
+
+# One alternative per link type, highest priority first. Every alternative
+# has a bounded length, so a match attempt costs the same on any message.
+# The fyp link's unbounded `(.*)item_id=` tail is resolved by `_fyp_item_id`.
+LINK_PATTERN = re.compile(
+    r"(?P<long>(?P<long_http>http:|https:\/\/)?(www\.)?tiktok\.com\/(@.{1,24})\/video\/(?P<long_id>\d{15,30}))"
+    r"|(?P<short>(?P<short_http>http:|https:\/\/)?((?!ww)\w{2})\.tiktok.com\/(?P<short_id>\w{5,15}))"
+    r"|(?P<medium>(?P<medium_http>http:|https:\/\/)?m\.tiktok\.com\/v\/(?P<medium_id>\d{15,30}))"
+    r"|(?P<fyp>(?P<fyp_http>http:|https:\/\/)?(www)?\.tiktok.com\/)"
+)
+ITEM_ID_PATTERN = re.compile(r"item_id=(?P<fyp_id>\d{5,30})")
+LINK_TYPES = {
+    "long": VideoIdType.LONG,
+    "short": VideoIdType.SHORT,
+    "medium": VideoIdType.MEDIUM,
+    "fyp": VideoIdType.FYP,
+}
+SCHEMES = ("https://", "http:")
+
+
+def check_for_link(content: str) -> Optional["LinkData"]:
+    """
+    Checks if the content has a TikTok video.
+
+    Messages without "tiktok" are rejected with a substring search. Otherwise
+    the link pattern is only tried at the few positions that can start a
+    link just before each "tiktok". When several link types are present the
+    priority is long, short, medium, then fyp.
+
+    Every step is bounded, so the cost is linear in the message length even
+    for crafted messages.
+
+    args:
+        content: The content to check.
+
+    returns:
+        LinkData
+    """
+    if not isinstance(content, str):
+        print(f"{content} is not a string")
+        print(type(content))
+        return None
+
+    found: Dict[str, LinkData] = {}
+    item_ids: Dict[int, Optional[re.Match]] = {}
+    scanned = 0
+    index = content.find("tiktok")
+    while index != -1:
+        if not content.startswith("com/", index + 7):
+            # every link continues "tiktok.com/"
+            index = content.find("tiktok", index + 1)
+            continue
+        for position in _link_starts(content, index, scanned):
+            match = LINK_PATTERN.match(content, position)
+            if not match or match.lastgroup in found:
+                continue
+            if match.lastgroup == "fyp":
+                if item_id := _fyp_item_id(content, match.end(), item_ids):
+                    found["fyp"] = _link_data(match, item_id)
+                continue
+            link = _link_data(match)
+            if link.type == VideoIdType.LONG:
+                return link
+            found[match.lastgroup] = link
+        scanned = index + 1
+        index = content.find("tiktok", scanned)
+
+    for kind in LINK_TYPES:
+        if link := found.get(kind):
+            return link
+    return None
+
+
+def find_links(content: str, limit: Optional[int] = None) -> List["LinkData"]:
+    """
+    Finds every TikTok video link in the content, in order.
+
+    Links to the same video are only returned once. Links don't overlap, the
+    scan resumes after the end of each link found.
+
+    args:
+        content: The content to check.
+        limit: The most links to return.
+
+    returns:
+        A list of LinkData.
+    """
+    if not isinstance(content, str):
+        return []
+
+    links: List[LinkData] = []
+    seen = set()
+    item_ids: Dict[int, Optional[re.Match]] = {}
+    scanned = 0
+    index = content.find("tiktok")
+    while index != -1 and (limit is None or len(links) < limit):
+        if content.startswith("com/", index + 7):
+            for position in _link_starts(content, index, scanned):
+                if not (match := LINK_PATTERN.match(content, position)):
+                    continue
+                item_id = None
+                if match.lastgroup == "fyp":
+                    if not (item_id := _fyp_item_id(content, match.end(), item_ids)):
+                        continue
+                link = _link_data(match, item_id)
+                if (link.type, link.id) not in seen:
+                    seen.add((link.type, link.id))
+                    links.append(link)
+                scanned = item_id.end() if item_id else match.end()
+                break
+        index = content.find("tiktok", max(index + 1, scanned))
+    return links
+
+
+def _link_starts(content: str, index: int, scanned: int) -> List[int]:
+    """
+    Lists, in order, the positions a link using the "tiktok" at `index` can
+    start at. That is an optional scheme followed by `www.`, `xx.`, `m.`, `.`
+    or nothing, the last also when "tiktok" follows another subdomain.
+    """
+    if index > 0 and content[index - 1] == ".":
+        hosts = (index - 4, index - 3, index - 2, index - 1, index)
+    else:
+        hosts = (index,)
+
+    starts = set()
+    for host in hosts:
+        starts.add(host)
+        for scheme in SCHEMES:
+            if host >= len(scheme) and content.startswith(scheme, host - len(scheme)):
+                starts.add(host - len(scheme))
+    return sorted(start for start in starts if start >= max(scanned, 0))
+
+
+def _fyp_item_id(
+    content: str, start: int, item_ids: Dict[int, Optional[re.Match]]
+) -> Optional[re.Match]:
+    """
+    Finds the `item_id=` a fyp link starting its path at `start` ends with.
+
+    That is the last valid `item_id=` on the same line, as with a greedy
+    `(.*)item_id=`. It is searched once per line and memoized by line end.
+    """
+    line_end = content.find("\n", start)
+    if line_end == -1:
+        line_end = len(content)
+
+    if line_end not in item_ids:
+        line_start = content.rfind("\n", 0, start) + 1
+        item_ids[line_end] = None
+        end = line_end
+        while (position := content.rfind("item_id=", line_start, end)) != -1:
+            if match := ITEM_ID_PATTERN.match(content, position, line_end):
+                item_ids[line_end] = match
+                break
+            end = position + len("item_id=") - 1
+
+    item_id = item_ids[line_end]
+    if item_id and item_id.start() >= start:
+        return item_id
+    return None
+
+
+def _link_data(match: re.Match, item_id: Optional[re.Match] = None) -> "LinkData":
+    kind = match.lastgroup
+    if item_id:
+        url = match.string[match.start() : item_id.end()]
+        id = item_id.group("fyp_id")
+    else:
+        url = match.group(kind)
+        id = match.group(f"{kind}_id")
+    if not match.group(f"{kind}_http"):
+        url = f"https://{url}"
+    return LinkData.from_list([LINK_TYPES[kind], id, url])
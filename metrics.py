@@ -0,0 +1,179 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from aiohttp import web
+
+PREFIX = "tiktoker"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+""" Upper bounds in seconds """
+
+
+class Histogram:
+    """
+    Counts observations into fixed buckets, Prometheus style.
+
+    Observing is a binary search and an increment, so it is cheap enough for
+    every stage of every conversion.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        """
+        returns:
+            (upper bound, observations up to it) pairs, ending with +Inf.
+        """
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield ("+Inf" if bound == float("inf") else repr(bound)), total
+
+
+class Metrics:
+    """
+    Latency histograms per stage and counters per outcome of the conversions.
+
+    They are served in the Prometheus text format on `/metrics` together with
+    the numeric values of `collect`, which is meant to be `bot.diagnostics`.
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, Histogram] = {}
+        self.outcomes = Counter()
+        self.collect: Optional[Callable[[], dict]] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if (histogram := self.stages.get(stage)) is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def count(self, outcome: str, amount: int = 1) -> None:
+        self.outcomes[outcome] += amount
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Observes how long the block takes, exceptions included."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, perf_counter() - start)
+
+    def timed(self, stage: str) -> Callable:
+        """Decorates a coroutine function to observe every call."""
+
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def render(self) -> str:
+        """
+        returns:
+            Every metric in the Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Time spent per conversion stage.",
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            for bound, count in histogram.cumulative():
+                lines.append(
+                    f'{PREFIX}_stage_seconds_bucket{{stage="{_escape(stage)}",'
+                    f'le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'{PREFIX}_stage_seconds_sum{{stage="{_escape(stage)}"}} '
+                f"{histogram.sum!r}"
+            )
+            lines.append(
+                f'{PREFIX}_stage_seconds_count{{stage="{_escape(stage)}"}} '
+                f"{histogram.count}"
+            )
+
+        lines.append(f"# HELP {PREFIX}_outcomes_total Conversions per outcome.")
+        lines.append(f"# TYPE {PREFIX}_outcomes_total counter")
+        for outcome, count in sorted(self.outcomes.items()):
+            lines.append(
+                f'{PREFIX}_outcomes_total{{outcome="{_escape(outcome)}"}} {count}'
+            )
+
+        if self.collect is not None:
+            lines.append(f"# HELP {PREFIX}_state State of the in-memory subsystems.")
+            lines.append(f"# TYPE {PREFIX}_state gauge")
+            for subsystem, stats in self.collect().items():
+                for name, value in _flatten(stats):
+                    lines.append(
+                        f'{PREFIX}_state{{subsystem="{_escape(subsystem)}",'
+                        f'name="{_escape(name)}"}} {value!r}'
+                    )
+        return "\n".join(lines) + "\n"
+
+    async def start(
+        self,
+        port: int,
+        host: str = "127.0.0.1",
+        collect: Optional[Callable[[], dict]] = None,
+    ) -> None:
+        """
+        Serves `/metrics` on a local port.
+
+        args:
+            port: The port.
+            host: The interface, local only by default.
+            collect: Returns the subsystem stats to export as gauges.
+        """
+        self.collect = collect
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.render(), content_type="text/plain", charset="utf-8"
+        )
+
+
+def _flatten(stats: dict, prefix: str = "") -> List[Tuple[str, float]]:
+    """Lists the numeric values of nested stats with dotted names."""
+    values = []
+    for key, value in stats.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.extend(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)):
+            values.append((name, float(value)))
+    return values
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
@@ -0,0 +1,55 @@
+from array import array
+from bisect import bisect_left
+from sys import getsizeof
+from typing import Dict, Iterable
+
+
+class OptedOutIndex:
+    """
+    The ids of users who opted out of usage data, held in memory.
+
+    Ids are kept in a sorted array of 64-bit integers, 8 bytes per user, and
+    membership is a binary search.
+    """
+
+    def __init__(self, user_ids: Iterable[int] = ()) -> None:
+        self._ids = array("q", sorted(set(user_ids)))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, user_id: int) -> bool:
+        index = bisect_left(self._ids, user_id)
+        return index < len(self._ids) and self._ids[index] == user_id
+
+    def load(self, user_ids: Iterable[int]) -> None:
+        """
+        Replaces the index contents.
+
+        args:
+            user_ids: Every opted out user id.
+        """
+        self._ids = array("q", sorted(set(user_ids)))
+
+    def add(self, user_id: int) -> None:
+        index = bisect_left(self._ids, user_id)
+        if index == len(self._ids) or self._ids[index] != user_id:
+            self._ids.insert(index, user_id)
+
+    def remove(self, user_id: int) -> None:
+        index = bisect_left(self._ids, user_id)
+        if index < len(self._ids) and self._ids[index] == user_id:
+            del self._ids[index]
+
+    def memory_usage(self) -> int:
+        """
+        returns:
+            Bytes used by the index.
+        """
+        return getsizeof(self._ids)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._ids), "bytes": self.memory_usage()}
+
+
+opted_out_index = OptedOutIndex()
@@ -0,0 +1,379 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import AsyncIterator, Deque, Dict, Optional
+from urllib.parse import urlsplit
+
+from metrics import metrics
+from settings import get_setting
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing sheddable work when upstream is saturated."""
+
+
+class CircuitOpen(Overloaded):
+    """Raised without calling upstream while an endpoint is known to be down."""
+
+
+class Call:
+    """The outcome of one upstream request, set by the caller."""
+
+    __slots__ = ("ok",)
+
+    def __init__(self) -> None:
+        self.ok = True
+
+
+class HostLimiter:
+    """
+    Admits requests to one upstream host.
+
+    A token bucket caps the request rate at `rate` per second with bursts of
+    `burst`. On top of it the number of requests in flight is capped by an
+    AIMD limit: every request that fails or is slower than `latency_target`
+    halves it, at most once per `latency_target`, and every other request
+    raises it by 1/limit, so about one per limit's worth of requests, up to
+    `max_concurrency`.
+
+    Requests that can't start right away wait in line, interactive ones
+    first. Sheddable ones are refused with `Overloaded` once `max_queued`
+    requests are already waiting.
+    """
+
+    def __init__(
+        self,
+        rate: float = 50,
+        burst: float = 100,
+        max_concurrency: int = 20,
+        min_concurrency: int = 2,
+        latency_target: float = 1.0,
+        max_queued: int = 100,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target
+        self.max_queued = max_queued
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.shed = 0
+        self.failed = 0
+        self.slow = 0
+        self._tokens = float(burst)
+        self._refilled = monotonic()
+        self._decreased = 0.0
+        self._interactive: Deque[asyncio.Future] = deque()
+        self._sheddable: Deque[asyncio.Future] = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._interactive) + len(self._sheddable)
+
+    async def acquire(self, shed: bool = False, wait: bool = True) -> None:
+        """
+        Waits for a token and a concurrency slot.
+
+        args:
+            shed: Whether the request may be refused instead of queued.
+            wait: Whether a sheddable request may queue at all, requests that
+                only help when they start right away, like hedges, don't.
+        """
+        if not self.queued and self.in_flight < int(self.limit) and self._take():
+            self.in_flight += 1
+            return
+        if shed and (not wait or self.queued >= self.max_queued):
+            self.shed += 1
+            metrics.count("shed")
+            raise Overloaded("TikTok is overloaded, try again later")
+
+        waiter = asyncio.get_running_loop().create_future()
+        (self._sheddable if shed else self._interactive).append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1  # admitted just as the caller gave up
+                self._dispatch()
+            raise
+
+    def release(self, latency: float, ok: Optional[bool]) -> None:
+        """
+        Frees the slot of a finished request and adapts the limit.
+
+        args:
+            latency: How long the request took, in seconds.
+            ok: Whether upstream answered normally, None when the request was
+                abandoned and tells nothing about upstream.
+        """
+        self.in_flight -= 1
+        if ok is None:
+            self._dispatch()
+            return
+        if not ok or latency > self.latency_target:
+            if ok:
+                self.slow += 1
+            else:
+                self.failed += 1
+            now = monotonic()
+            if now - self._decreased >= self.latency_target:
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+                self._decreased = now
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+        self._dispatch()
+
+    def _take(self) -> bool:
+        now = monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._refilled) * self.rate
+        )
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _dispatch(self) -> None:
+        """Admits waiters while slots and tokens are available."""
+        while self.in_flight < int(self.limit):
+            queue = self._interactive or self._sheddable
+            while queue and queue[0].done():  # cancelled while waiting
+                queue.popleft()
+            if not queue:
+                if self._interactive or self._sheddable:
+                    continue
+                return
+            if not self._take():
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(
+                        (1 - self._tokens) / self.rate, self._refill
+                    )
+                return
+            self.in_flight += 1
+            queue.popleft().set_result(None)
+
+    def _refill(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "tokens": self._tokens,
+            "shed": self.shed,
+            "failed": self.failed,
+            "slow": self.slow,
+        }
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream endpoint is down.
+
+    After `failure_threshold` failures in a row the circuit opens and requests
+    are refused with `CircuitOpen` for `reset_timeout` seconds. Then it is
+    half-open: up to `probes` trial requests go through, the first one that
+    succeeds closes the circuit and one that fails opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self, failure_threshold: int = 5, reset_timeout: float = 30, probes: int = 1
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = 0
+
+    def admit(self) -> bool:
+        """
+        Checks whether a request may go through, counting it as a probe when
+        the circuit is half-open.
+
+        returns:
+            Whether it is a probe, to hand back to `record`.
+        """
+        if self.state == self.OPEN:
+            if monotonic() - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpen("TikTok is unavailable, try again later")
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing >= self.probes:
+                self.rejected += 1
+                raise CircuitOpen("TikTok is unavailable, try again later")
+            self._probing += 1
+            return True
+        return False
+
+    def record(self, ok: Optional[bool], probe: bool) -> None:
+        """
+        Records the outcome of an admitted request.
+
+        args:
+            ok: Whether upstream answered normally, None when the request
+                never reached it or was abandoned.
+            probe: What `admit` returned.
+        """
+        if probe:
+            self._probing -= 1
+        if ok is None:
+            return
+        if ok:
+            self.failures = 0
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                metrics.count("circuit_closed")
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.failures >= self.failure_threshold
+        ):
+            self.state = self.OPEN
+            self.opened += 1
+            self._opened_at = monotonic()
+            metrics.count("circuit_opened")
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "open": int(self.state == self.OPEN),
+            "half_open": int(self.state == self.HALF_OPEN),
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class UpstreamLimiter:
+    """
+    A HostLimiter per upstream host, created on first use.
+
+    Hosts use the default rate and burst unless `host_rates` has their own.
+    Every endpoint, the host unless the caller names it, also has its own
+    CircuitBreaker.
+    """
+
+    def __init__(
+        self,
+        host_rates: Optional[Dict[str, tuple]] = None,
+        breaker_options: Optional[Dict[str, float]] = None,
+        **defaults,
+    ) -> None:
+        self.host_rates = host_rates or {}
+        self.breaker_options = breaker_options or {}
+        self.defaults = defaults
+        self.hosts: Dict[str, HostLimiter] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    @classmethod
+    def from_settings(cls) -> "UpstreamLimiter":
+        """
+        Creates a limiter configured from the .env file.
+
+        UPSTREAM_HOST_RATES overrides the rate and burst per host, as in
+        `api2.musical.ly=50/100,tiktok.com=5/10`.
+
+        returns:
+            An UpstreamLimiter.
+        """
+        host_rates = {}
+        for entry in get_setting("UPSTREAM_HOST_RATES", "").split(","):
+            if "=" in entry:
+                host, _, rate = entry.strip().partition("=")
+                rate, _, burst = rate.partition("/")
+                host_rates[host] = (float(rate), float(burst or rate))
+        return cls(
+            host_rates,
+            {
+                "failure_threshold": get_setting("CIRCUIT_FAILURE_THRESHOLD", 5, int),
+                "reset_timeout": get_setting("CIRCUIT_RESET_TIMEOUT", 30, float),
+                "probes": get_setting("CIRCUIT_PROBES", 1, int),
+            },
+            rate=get_setting("UPSTREAM_RATE", 50, float),
+            burst=get_setting("UPSTREAM_BURST", 100, float),
+            max_concurrency=get_setting("UPSTREAM_MAX_CONCURRENCY", 20, int),
+            min_concurrency=get_setting("UPSTREAM_MIN_CONCURRENCY", 2, int),
+            latency_target=get_setting("UPSTREAM_LATENCY_TARGET", 1.0, float),
+            max_queued=get_setting("UPSTREAM_MAX_QUEUED", 100, int),
+        )
+
+    def host(self, url: str) -> HostLimiter:
+        host = urlsplit(url).netloc
+        if (limiter := self.hosts.get(host)) is None:
+            options = dict(self.defaults)
+            if host in self.host_rates:
+                options["rate"], options["burst"] = self.host_rates[host]
+            limiter = self.hosts[host] = HostLimiter(**options)
+        return limiter
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        if (breaker := self.breakers.get(endpoint)) is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(**self.breaker_options)
+        return breaker
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        url: str,
+        shed: bool = False,
+        wait: bool = True,
+        endpoint: Optional[str] = None,
+    ) -> AsyncIterator[Call]:
+        """
+        Holds a slot of the url's host for the duration of a request.
+
+        Set `ok` of the yielded Call to False when upstream answers with an
+        error status, exceptions count as failures on their own and cancelled
+        requests don't count.
+
+        args:
+            url: The url requested.
+            shed: Whether the request may be refused with `Overloaded`.
+            wait: Whether a sheddable request may wait for a slot.
+            endpoint: The circuit breaker to go through, the host's by default.
+        """
+        limiter = self.host(url)
+        breaker = self.breaker(endpoint or urlsplit(url).netloc)
+        probe = breaker.admit()
+        try:
+            await limiter.acquire(shed, wait)
+        except BaseException:
+            breaker.record(None, probe)
+            raise
+        call = Call()
+        start = monotonic()
+        try:
+            yield call
+        except asyncio.CancelledError:
+            call.ok = None
+            raise
+        except Exception:
+            call.ok = False
+            raise
+        finally:
+            limiter.release(monotonic() - start, call.ok)
+            breaker.record(call.ok, probe)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {host: limiter.stats() for host, limiter in self.hosts.items()}
+
+    def circuit_stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            endpoint: breaker.stats() for endpoint, breaker in self.breakers.items()
+        }
+
+
+upstream_limiter = UpstreamLimiter.from_settings()
@@ -0,0 +1,23 @@
+from typing import Any, Callable, Optional
+
+from dotenv import dotenv_values
+
+_values = dotenv_values(".env")
+
+
+def get_setting(key: str, default: Any = None, cast: Callable[[str], Any] = str) -> Any:
+    """
+    Gets an optional setting from the .env file.
+
+    args:
+        key: The name of the setting.
+        default: Returned when the setting is missing or empty.
+        cast: Converts the raw string value.
+
+    returns:
+        The setting value.
+    """
+    value: Optional[str] = _values.get(key)
+    if value is None or value.strip() == "":
+        return default
+    return cast(value.strip())
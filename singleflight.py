@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one shared task.
+
+    The first caller for a key starts the work; everyone arriving while it is
+    in flight awaits the same task. Waiters are shielded from each other, so a
+    cancelled waiter does not cancel the shared work, and an exception raised
+    by the work is re-raised to every waiter.
+    """
+
+    def __init__(self) -> None:
+        self.started = 0
+        self.coalesced = 0
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(
+        self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """
+        Runs `func(*args, **kwargs)` unless a call for `key` is already in flight.
+
+        args:
+            key: Identifies calls that may share a result.
+            func: The coroutine function doing the work.
+
+        returns:
+            The result of the shared call.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # mark the exception retrieved, every waiter may have been cancelled
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._inflight),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
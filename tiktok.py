@@ -1,3 +1,4 @@
+import asyncio
 from typing import Any, Dict, List, Optional
 import aiohttp
 from attr import define
@@ -5,38 +6,35 @@ import attr
 import dis_snek as dis
 from dis_snek.client.utils.converters import timestamp_converter
 import re
+from time import monotonic
 
+try:
+    import orjson as json
+except ImportError:
+    import json
 
-@attr.s()
-class TikTokObject(dis.DictSerializationMixin):
-    @classmethod
-    def _process_dict(cls, data: Dict[str, Any]) -> Dict[str, Any]:
-        return super()._process_dict(data)
+from cache import TTLCache
+from hedging import aweme_hedger
+from http_client import http_client
+from metrics import metrics
+from ratelimit import CircuitOpen, Overloaded, upstream_limiter
+from settings import get_setting
+from singleflight import SingleFlight
 
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]):
-        data = cls._process_dict(
-            data,
-        )
-        return cls(**cls._filter_kwargs(data, cls._get_init_keys()))
 
-    @classmethod
-    def from_list(cls, datas: List[Dict[str, Any]]):
-        return [
-            cls.from_dict(
-                data,
-            )
-            for data in datas
-        ]
+@define(frozen=True)
+class TikTokObject:
+    """
+    Base of the TikTok models.
 
-    def update_from_dict(self, data) -> None:
-        data = self._process_dict(data)
-        for key, value in self._filter_kwargs(data, self._get_keys()).items():
-            # todo improve
-            setattr(self, key, value)
+    Models are slotted and immutable. `from_dict` reads the fields straight
+    from the API payload, it never changes the payload and no reference to it
+    is kept. The only copies are the hashtags TikTokData keeps, trimmed to
+    TAG_KEYS, for its description.
+    """
 
 
-@define
+@define(frozen=True)
 class Video(TikTokObject):
     download_url: str = attr.ib()
     cover_url: str = attr.ib()
@@ -45,19 +43,18 @@ class Video(TikTokObject):
     """ Bytes """
 
     @classmethod
-    def _process_dict(cls, data: dict) -> dict:
-        if play_addr := data.get("play_addr"):
-            data["download_url"] = play_addr.get("url_list")[2]
-            data["video_uri"] = play_addr.get("uri")
-            data["size"] = play_addr.get("data_size")
-
-        if cover_addr := data.get("cover"):
-            data["cover_url"] = cover_addr.get("url_list")[0]
-
-        return data
+    def from_dict(cls, data: dict) -> "Video":
+        play_addr = data.get("play_addr") or {}
+        cover = data.get("cover") or {}
+        return cls(
+            download_url=play_addr.get("url_list")[2],
+            cover_url=cover.get("url_list")[0],
+            video_uri=play_addr.get("uri"),
+            size=play_addr.get("data_size"),
+        )
 
 
-@define
+@define(frozen=True)
 class Statistics(TikTokObject):
     play_count: int = attr.ib()
     like_count: int = attr.ib()
@@ -66,21 +63,17 @@ class Statistics(TikTokObject):
     download_count: int = attr.ib()
 
     @classmethod
-    def _process_dict(cls, data: dict) -> dict:
-        if like_count := data.get("digg_count"):
-            data["like_count"] = like_count
-        if comment_count := data.get("comment_count"):
-            data["comment_count"] = comment_count
-        if share_count := data.get("share_count"):
-            data["share_count"] = share_count
-        if download_count := data.get("download_count"):
-            data["download_count"] = download_count
-        if play_count := data.get("play_count"):
-            data["play_count"] = play_count
-        return data
-
-
-@define
+    def from_dict(cls, data: dict) -> "Statistics":
+        return cls(
+            play_count=data.get("play_count"),
+            like_count=data.get("digg_count"),
+            comment_count=data.get("comment_count"),
+            share_count=data.get("share_count"),
+            download_count=data.get("download_count"),
+        )
+
+
+@define(frozen=True)
 class Music(TikTokObject):
     id: int = attr.ib(converter=int)
     title: str = attr.ib()
@@ -94,25 +87,23 @@ class Music(TikTokObject):
     avatar_url: str = attr.ib(default=None)
 
     @classmethod
-    def _process_dict(cls, data: dict) -> dict:
-        if play_url := data.get("play_url"):
-            data["play_url"] = play_url.get("url_list")[0]
-        data["website_url"] = f"https://www.tiktok.com/music/id-{data.get('id')}"
-
-        if cover_medium := data.get("cover_medium"):
-            data["cover_url"] = cover_medium.get("url_list")[0]
-        if avatar_thumb := data.get("avatar_thumb"):
-            data["avatar_url"] = avatar_thumb.get("url_list")[0]
-        if title := data.get("title"):
-            data["title"] = title
-        if id := data.get("id"):
-            data["id"] = id
-        data["owner_url"] = f"https://www.tiktok.com/@{data.get('owner_handle')}"
-
-        return data
+    def from_dict(cls, data: dict) -> "Music":
+        avatar_thumb = data.get("avatar_thumb")
+        return cls(
+            id=data.get("id"),
+            title=data.get("title"),
+            play_url=data.get("play_url").get("url_list")[0],
+            website_url=f"https://www.tiktok.com/music/id-{data.get('id')}",
+            cover_url=data.get("cover_medium").get("url_list")[0],
+            author=data.get("author"),
+            owner_nickname=data.get("owner_nickname"),
+            owner_handle=data.get("owner_handle"),
+            owner_url=f"https://www.tiktok.com/@{data.get('owner_handle')}",
+            avatar_url=avatar_thumb.get("url_list")[0] if avatar_thumb else None,
+        )
 
 
-@define
+@define(frozen=True)
 class Author(TikTokObject):
     nickname: str = attr.ib()
     unique_id: str = attr.ib()
@@ -120,22 +111,16 @@ class Author(TikTokObject):
     avatar: str = attr.ib()
 
     @classmethod
-    def _process_dict(cls, data: dict) -> dict:
-        if unique_id := data.get("unique_id"):
-            data["url"] = "https://www.tiktok.com/@" + unique_id
-
-        if avatar_thumb := data.get("avatar_thumb"):
-            data["avatar"] = avatar_thumb.get("url_list")[0]
-
-        if nickname := data.get("nickname"):
-            data["nickname"] = nickname
-        if unique_id := data.get("unique_id"):
-            data["unique_id"] = unique_id
-
-        return data
+    def from_dict(cls, data: dict) -> "Author":
+        return cls(
+            nickname=data.get("nickname"),
+            unique_id=data.get("unique_id"),
+            url="https://www.tiktok.com/@" + data.get("unique_id"),
+            avatar=data.get("avatar_thumb").get("url_list")[0],
+        )
 
 
-@define
+@define(frozen=True)
 class Description(TikTokObject):
     raw: Optional[str] = attr.ib(default=None)
     cleaned: Optional[str] = attr.ib(default=None)
@@ -143,71 +128,300 @@ class Description(TikTokObject):
     tags: Optional[List[str]] = attr.ib(default=None)
 
     @classmethod
-    def _process_dict(cls, data: dict) -> dict:
-        if raw := data.get("desc"):
-            data["raw"] = raw
-        data["cleaned"] = clean_desc(data.get("text_extra"), raw)
-        data["tags"] = [
-            f"{tag['hashtag_name']}"
-            for tag in data.get("text_extra")
-            if tag.get("type") == 1
-        ]
-        return data
+    def from_dict(cls, data: dict) -> "Description":
+        raw = data.get("desc") or None
+        text_extra = data.get("text_extra") or []
+        return cls(
+            raw=raw,
+            cleaned=clean_desc(text_extra, raw),
+            tags=[
+                f"{tag['hashtag_name']}" for tag in text_extra if tag.get("type") == 1
+            ],
+        )
 
 
 def clean_desc(text_extra, desc) -> str:
+    """
+    Removes the #hashtags from a description, keeping its casing.
+
+    Hashtags are cut at their text_extra offsets, read as code points or, for
+    descriptions with emoji, as UTF-16 code units. When neither points at the
+    hashtag, its first free occurrence is searched for instead, ignoring case.
+    Whitespace is collapsed once at the end.
+
+    args:
+        text_extra: The text_extra list of the aweme.
+        desc: The description.
+
+    returns:
+        The description without hashtags.
+    """
+    if not desc:
+        return ""
+
+    taken = bytearray(len(desc))
+    utf16: Optional[List[int]] = None
+    spans = []
     for tag in text_extra:
-        if tag.get("type") == 1:
-            desc: str
-            desc = desc.lower().replace(f"#{tag.get('hashtag_name').lower()}", "", 1)
-            desc = re.sub(r"\s+", " ", desc)
-    return desc.strip()
+        if tag.get("type") != 1 or not (name := tag.get("hashtag_name")):
+            continue
+        hashtag = f"#{name}".casefold()
+        start, end = tag.get("start"), tag.get("end")
+        if not (isinstance(start, int) and isinstance(end, int) and 0 <= start < end):
+            span = None
+        elif _is_free(desc, taken, start, end, hashtag):
+            span = (start, end)
+        else:
+            if utf16 is None:
+                utf16 = _utf16_indexes(desc)
+            span = None
+            if end < len(utf16):
+                start, end = utf16[start], utf16[end]
+                if _is_free(desc, taken, start, end, hashtag):
+                    span = (start, end)
+
+        if span is None:
+            for match in re.finditer(re.escape(f"#{name}"), desc, re.IGNORECASE):
+                if taken.find(1, match.start(), match.end()) == -1:
+                    span = match.span()
+                    break
+        if span is not None:
+            taken[span[0] : span[1]] = b"\x01" * (span[1] - span[0])
+            spans.append(span)
+
+    parts = []
+    position = 0
+    for start, end in sorted(spans):
+        parts.append(desc[position:start])
+        position = end
+    parts.append(desc[position:])
+    return " ".join("".join(parts).split())
+
+
+def _is_free(desc: str, taken: bytearray, start: int, end: int, hashtag: str) -> bool:
+    """Whether desc[start:end] is the hashtag and wasn't cut already."""
+    return desc[start:end].casefold() == hashtag and taken.find(1, start, end) == -1
+
+
+def _utf16_indexes(desc: str) -> List[int]:
+    """Maps UTF-16 code unit offsets of the description to str indexes."""
+    indexes = []
+    for index, char in enumerate(desc):
+        indexes.append(index)
+        if ord(char) > 0xFFFF:  # a surrogate pair in UTF-16
+            indexes.append(index)
+    indexes.append(len(desc))
+    return indexes
+
+
+@define(frozen=True)
+class TikTokData(TikTokObject):
+    """
+    A TikTok video.
 
+    Video, statistics, music and author are small and built up front. The
+    description is built on first access, it is the only part with real
+    parsing work and the auto-embed path never reads it.
+    """
 
-@define
-class TikTokData(TikTokObject):
-    id: str = attr.ib()
-    video: "Video" = attr.ib()
+    id: int = attr.ib()
     created: "dis.Timestamp" = attr.ib(converter=timestamp_converter)
-    statistics: "Statistics" = attr.ib()
     share_url: str = attr.ib()
-    description: "Description" = attr.ib()
+    video: "Video" = attr.ib()
+    statistics: "Statistics" = attr.ib()
     music: "Music" = attr.ib()
     author: "Author" = attr.ib()
+    # the description and what it is built from are left out of eq and hash,
+    # it is derived from the payload and memoized in place
+    _desc: Optional[str] = attr.ib(default=None, repr=False, eq=False)
+    _text_extra: Optional[List[Dict[str, Any]]] = attr.ib(
+        default=None, repr=False, eq=False
+    )
+    """ Released once the description is built """
+    _description: Optional["Description"] = attr.ib(
+        default=None, init=False, repr=False, eq=False
+    )
+
+    @property
+    def description(self) -> "Description":
+        if self._description is None:
+            # frozen, the memoized value is set around attrs
+            object.__setattr__(
+                self,
+                "_description",
+                Description.from_dict(
+                    {"desc": self._desc, "text_extra": self._text_extra}
+                ),
+            )
+            object.__setattr__(self, "_text_extra", None)
+        return self._description
 
     @classmethod
-    def _process_dict(cls, data: dict) -> "TikTokData":
+    def from_dict(cls, data: dict) -> "TikTokData":
         """data is the aweme_details dict"""
+        share_url = data.get("share_url")
+        return cls(
+            id=int(data.get("aweme_id")),
+            created=data.get("create_time"),
+            # remove unnesesary query params
+            share_url=share_url.split(".html")[0] if share_url else share_url,
+            video=Video.from_dict(data.get("video")),
+            statistics=Statistics.from_dict(data.get("statistics")),
+            music=Music.from_dict(data.get("music")),
+            author=Author.from_dict(data.get("author")),
+            desc=data.get("desc"),
+            text_extra=[
+                {key: tag.get(key) for key in TAG_KEYS}
+                for tag in data.get("text_extra") or []
+                if tag.get("type") == 1
+            ],
+        )
+
 
-        if id := data.get("aweme_id"):
-            data["id"] = int(id)
-        if video := data.get("video"):
-            data["video"] = Video.from_dict(video)
-        if created := data.get("create_time"):
-            data["created"] = created
-        if statistics := data.get("statistics"):
-            data["statistics"] = Statistics.from_dict(statistics)
-        if share_url := data.get("share_url"):
-            data["share_url"] = share_url.split(".html")[
-                0
-            ]  # remove unnesesary query params
-        data["description"] = Description.from_dict(data)
-        if music := data.get("music"):
-            data["music"] = Music.from_dict(music)
-
-        if author := data.get("author"):
-            data["author"] = Author.from_dict(author)
-
-        return data
-
-
-async def get_tiktok(video_id: int) -> Optional["TikTokData"]:
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(5)) as session:
-        async with session.get(
-            f"https://api2.musical.ly/aweme/v1/aweme/detail/?aweme_id={video_id}",
+TAG_KEYS = ("type", "hashtag_name", "start", "end")
+""" The parts of a text_extra entry the description is built from """
+
+
+class VideoUnavailable(ValueError):
+    """Raised for deleted or private videos."""
+
+
+class TikTokCache:
+    """
+    A cache of parsed TikTokData keyed by aweme id.
+
+    Static fields (author, music, video uris) live for `ttl` seconds, the
+    volatile `Statistics` only for `statistics_ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, statistics_ttl: float) -> None:
+        self.statistics_ttl = statistics_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = TTLCache(maxsize, ttl)
+
+    def get(self, video_id: int, statistics: bool = False) -> Optional["TikTokData"]:
+        """
+        Gets a cached TikTok.
+
+        args:
+            video_id: The aweme id.
+            statistics: Whether the caller needs fresh statistics.
+
+        returns:
+            The cached TikTokData, or None on a miss.
+        """
+        entry = self._entries.get(video_id)
+        if entry is None or (
+            statistics and monotonic() - entry[0] > self.statistics_ttl
+        ):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, video_id: int, tiktok: "TikTokData") -> None:
+        self._entries.set(video_id, (monotonic(), tiktok))
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "maxsize": self._entries.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+tiktok_cache = TikTokCache(
+    maxsize=get_setting("TIKTOK_CACHE_SIZE", 1024, int),
+    ttl=get_setting("TIKTOK_CACHE_TTL", 3600, float),
+    statistics_ttl=get_setting("TIKTOK_STATISTICS_TTL", 60, float),
+)
+unavailable_videos = TTLCache(
+    get_setting("UNAVAILABLE_VIDEO_CACHE_SIZE", 1024, int),
+    get_setting("UNAVAILABLE_VIDEO_TTL", 300, float),
+)  # deleted or private ids, not fetched again until they expire
+tiktok_flights = SingleFlight()
+API_URL = get_setting("TIKTOK_API_URL", "https://api2.musical.ly")
+
+
+async def get_tiktok(
+    video_id: int, statistics: bool = False, shed: bool = False
+) -> Optional["TikTokData"]:
+    """
+    Gets a TikTok, from the cache when possible.
+
+    args:
+        video_id: The aweme id.
+        statistics: Whether the caller needs fresh statistics.
+        shed: Whether the request may be refused with `Overloaded` instead of
+            waiting while upstream is saturated, for work nobody waits on.
+
+    returns:
+        The TikTokData.
+    """
+    if video_id is None:
+        raise ValueError("Unable to get TikTok data")
+    video_id = int(video_id)
+
+    if tiktok := tiktok_cache.get(video_id, statistics):
+        return tiktok
+    if unavailable_videos.get(video_id):
+        raise VideoUnavailable("Unable to get TikTok data")
+
+    try:
+        return await tiktok_flights.do(video_id, _load_tiktok, video_id, shed)
+    except Overloaded as e:
+        if shed or isinstance(e, CircuitOpen):
+            raise
+        # joined a sheddable request that was refused, wait in line instead
+        return await tiktok_flights.do(video_id, _load_tiktok, video_id, False)
+
+
+async def _load_tiktok(video_id: int, shed: bool = False) -> "TikTokData":
+    try:
+        tiktok = await fetch_tiktok(video_id, shed)
+    except VideoUnavailable:
+        unavailable_videos.set(video_id, True)
+        raise
+    tiktok_cache.set(video_id, tiktok)
+    return tiktok
+
+
+@metrics.timed("aweme_fetch")
+async def fetch_tiktok(video_id: int, shed: bool = False) -> Optional["TikTokData"]:
+    url = f"{API_URL}/aweme/v1/aweme/detail/?aweme_id={video_id}"
+    try:
+        data = await aweme_hedger.run(
+            lambda hedge: _request_aweme(url, shed or hedge, not hedge)
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        metrics.count("upstream_error")
+        raise
+
+    if data.get("status_code") != 0:  # throttled or refused by the API
+        metrics.count("upstream_error")
+        raise ValueError("Unable to get TikTok data")
+    if data.get("aweme_detail"):
+        return TikTokData.from_dict(data["aweme_detail"])
+    metrics.count("deleted_video")  # answered, but without the aweme
+    raise VideoUnavailable("Unable to get TikTok data")
+
+
+async def _request_aweme(url: str, shed: bool, wait: bool = True) -> dict:
+    async with upstream_limiter.slot(url, shed, wait, "aweme_detail") as call:
+        start = monotonic()
+        async with http_client.session.get(
+            url,
             allow_redirects=False,
+            timeout=aiohttp.ClientTimeout(aweme_hedger.timeout()),
         ) as response:
-            data = await response.json()
-            if data.get("aweme_detail") and data.get("status_code") == 0:
-                return TikTokData.from_dict(data["aweme_detail"])
-            raise ValueError("Unable to get TikTok data")
+            call.ok = response.status < 500 and response.status != 429
+            if not call.ok:
+                response.raise_for_status()
+            data = json.loads(await response.read())
+    aweme_hedger.observe(monotonic() - start)
+    return data
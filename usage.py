@@ -0,0 +1,132 @@
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from database import UsageData
+from settings import get_setting
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class UsageWriter:
+    """
+    Queues UsageData and writes it to Mongo in batches from a background task.
+
+    A batch is flushed once `batch_size` documents are queued or every
+    `flush_interval` seconds, whichever comes first. At most `max_queued`
+    documents are held in memory; past that the `policy` decides whether the
+    oldest or the newest document is dropped.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        flush_interval: float = 5,
+        max_queued: int = 10000,
+        policy: str = DROP_OLDEST,
+    ) -> None:
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown usage queue policy: {policy}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self.policy = policy
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: Deque[UsageData] = deque()
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._flush_lock = asyncio.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "UsageWriter":
+        """
+        Creates a writer configured from the .env file.
+
+        returns:
+            A UsageWriter.
+        """
+        return cls(
+            batch_size=get_setting("USAGE_BATCH_SIZE", 100, int),
+            flush_interval=get_setting("USAGE_FLUSH_INTERVAL", 5, float),
+            max_queued=get_setting("USAGE_MAX_QUEUED", 10000, int),
+            policy=get_setting("USAGE_QUEUE_POLICY", DROP_OLDEST),
+        )
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def submit(self, usage: UsageData) -> bool:
+        """
+        Queues a document without waiting for it to be written.
+
+        args:
+            usage: The usage data to write.
+
+        returns:
+            Whether the document was queued.
+        """
+        if len(self._queue) >= self.max_queued:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return False
+            self._queue.popleft()
+
+        self._queue.append(usage)
+        if len(self._queue) >= self.batch_size:
+            self._batch_ready.set()
+        return True
+
+    async def start(self) -> None:
+        """Starts the background flush task."""
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stops the background task and flushes everything still queued."""
+        self._closing = True
+        self._batch_ready.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Writes every queued document, one batch at a time."""
+        async with self._flush_lock:
+            while self._queue:
+                batch: List[UsageData] = [
+                    self._queue.popleft()
+                    for _ in range(min(self.batch_size, len(self._queue)))
+                ]
+                try:
+                    await UsageData.insert_many(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"Error: failed to write {len(batch)} usage documents: {e}")
+                    return
+                self.written += len(batch)
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": len(self._queue),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+usage_writer = UsageWriter.from_settings()
@@ -45,29 +45,31 @@ def usage(code, msg=""):
     sys.exit(code)
 
 
-def add(ctxt, id, str, fuzzy):
+def add(ctxt, id, str, fuzzy, messages=None):
     "Add a non-fuzzy translation to the dictionary."
-    global MESSAGES
+    if messages is None:
+        messages = MESSAGES
     if not fuzzy and str:
         if ctxt is None:
-            MESSAGES[id] = str
+            messages[id] = str
         else:
-            MESSAGES[b"%b\x04%b" % (ctxt, id)] = str
+            messages[b"%b\x04%b" % (ctxt, id)] = str
 
 
-def generate():
+def generate(messages=None):
     "Return the generated output."
-    global MESSAGES
+    if messages is None:
+        messages = MESSAGES
     # the keys are sorted in the .mo file
-    keys = sorted(MESSAGES.keys())
+    keys = sorted(messages.keys())
     offsets = []
     ids = strs = b""
     for id in keys:
         # For each string, we need size and file offset.  Each string is NUL
         # terminated; the NUL does not count into the size.
-        offsets.append((len(ids), len(id), len(strs), len(MESSAGES[id])))
+        offsets.append((len(ids), len(id), len(strs), len(messages[id])))
         ids += id + b"\0"
-        strs += MESSAGES[id] + b"\0"
+        strs += messages[id] + b"\0"
     output = ""
     # The header is 7 32-bit unsigned integers.  We don't use hash tables, so
     # the keys start right after the index tables.
@@ -100,6 +102,7 @@ def generate():
 
 
 def make(filename, outfile):
+    "Compile a .po file into a .mo file. Safe to call from several threads."
     ID = 1
     STR = 2
     CTXT = 3
@@ -119,6 +122,7 @@ def make(filename, outfile):
         print(msg, file=sys.stderr)
         sys.exit(1)
 
+    messages = {}
     section = msgctxt = None
     fuzzy = 0
 
@@ -133,7 +137,7 @@ def make(filename, outfile):
         lno += 1
         # If we get a comment line after a msgstr, this is a new entry
         if l[0] == "#" and section == STR:
-            add(msgctxt, msgid, msgstr, fuzzy)
+            add(msgctxt, msgid, msgstr, fuzzy, messages)
             section = msgctxt = None
             fuzzy = 0
         # Record a fuzzy mark
@@ -145,13 +149,13 @@ def make(filename, outfile):
         # Now we are in a msgid or msgctxt section, output previous section
         if l.startswith("msgctxt"):
             if section == STR:
-                add(msgctxt, msgid, msgstr, fuzzy)
+                add(msgctxt, msgid, msgstr, fuzzy, messages)
             section = CTXT
             l = l[7:]
             msgctxt = b""
         elif l.startswith("msgid") and not l.startswith("msgid_plural"):
             if section == STR:
-                add(msgctxt, msgid, msgstr, fuzzy)
+                add(msgctxt, msgid, msgstr, fuzzy, messages)
                 if not msgid:
                     # See whether there is an encoding declaration
                     p = HeaderParser()
@@ -211,10 +215,10 @@ def make(filename, outfile):
             sys.exit(1)
     # Add last entry
     if section == STR:
-        add(msgctxt, msgid, msgstr, fuzzy)
+        add(msgctxt, msgid, msgstr, fuzzy, messages)
 
     # Compute output
-    output = generate()
+    output = generate(messages)
 
     try:
         with open(outfile, "wb") as f:
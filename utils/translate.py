@@ -1,37 +1,195 @@
 import gettext
-from os import walk, system, getcwd
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from os import replace, walk
+from sys import getsizeof
+from time import perf_counter
+from typing import Dict, Iterator, List, Mapping, Optional
 import re
 
+from settings import get_setting
+from utils import msgfmt
+
+LOCALE_DIR = "./locale"
+
 regex = r"Language-Team: (.*)"
-languages = [dir for dir in walk("./locale")][0][1]
+languages = [dir for dir in walk(LOCALE_DIR)][0][1]
 language_names = {}
 
-for x in languages:
-    cwd = getcwd().replace("\\", "/")  # windows lol
-    system(
-        "python "
-        + cwd
-        + "/utils/msgfmt.py "
-        + cwd
-        + "/locale/"
-        + x
-        + "/LC_MESSAGES/bot.po"
-    )
+
+def compile_catalog(language: str, locale_dir: str = LOCALE_DIR) -> bool:
+    """
+    Compiles a language's bot.po into bot.mo.
+
+    Skipped when the .po content hash matches the one recorded next to the
+    existing .mo.
+
+    args:
+        language: The language directory name.
+        locale_dir: The locale directory.
+
+    returns:
+        Whether the catalog was compiled.
+    """
+    po_file = f"{locale_dir}/{language}/LC_MESSAGES/bot.po"
+    mo_file = f"{locale_dir}/{language}/LC_MESSAGES/bot.mo"
+    hash_file = mo_file + ".sha256"
+
+    with open(po_file, "rb") as file:
+        digest = sha256(file.read()).hexdigest()
+    try:
+        with open(mo_file, "rb"), open(hash_file, "r") as file:
+            if file.read() == digest:
+                return False
+    except OSError:
+        pass
+
+    try:
+        msgfmt.make(po_file, mo_file + ".tmp")
+    except SystemExit:  # msgfmt exits on syntax errors
+        print(f"Error: unable to compile {po_file}")
+        return False
+    replace(mo_file + ".tmp", mo_file)
+    with open(hash_file, "w") as file:
+        file.write(digest)
+    return True
+
+
+def compile_catalogs(
+    languages: List[str], locale_dir: str = LOCALE_DIR, workers: Optional[int] = None
+) -> List[str]:
+    """
+    Compiles the catalogs of several languages in parallel.
+
+    args:
+        languages: The language directory names.
+        locale_dir: The locale directory.
+        workers: The most catalogs compiled at once.
+
+    returns:
+        The languages that were compiled.
+    """
+    with ThreadPoolExecutor(workers) as executor:
+        compiled = executor.map(
+            lambda language: compile_catalog(language, locale_dir), languages
+        )
+        return [language for language, done in zip(languages, compiled) if done]
+
+
+def read_language_name(language: str, locale_dir: str = LOCALE_DIR) -> None:
     # open po file and get language team
     try:
         with open(
-            cwd + "/locale/" + x + "/LC_MESSAGES/bot.po", "r", encoding="UTF-8"
+            locale_dir + "/" + language + "/LC_MESSAGES/bot.po", "r", encoding="UTF-8"
         ) as file:
             if team := re.search(regex, file.read()):
-                language_names[x] = (team.group(1)).replace('\\n"', "")
+                language_names[language] = (team.group(1)).replace('\\n"', "")
     except:
-        continue
+        pass
 
 
-initilized_langs = {}
+compile_catalogs(languages)
 
 for x in languages:
-    initilized_langs[x] = gettext.translation("bot", "./locale", languages=[x])
+    read_language_name(x)
+
+
+class Catalogs(Mapping):
+    """
+    Translation catalogs by language, each loaded on first use.
+
+    Load time and memory of every loaded catalog are recorded in `stats`.
+    """
+
+    def __init__(self, languages: List[str], locale_dir: str = LOCALE_DIR) -> None:
+        self.locale_dir = locale_dir
+        self._languages = list(languages)
+        self._catalogs: Dict[str, gettext.GNUTranslations] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def __getitem__(self, language: str) -> gettext.GNUTranslations:
+        if (catalog := self._catalogs.get(language)) is None:
+            if language not in self._languages:
+                raise KeyError(language)
+            catalog = self.load(language)
+        return catalog
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._languages)
+
+    def __len__(self) -> int:
+        return len(self._languages)
+
+    def load(self, language: str) -> gettext.GNUTranslations:
+        """
+        Loads a catalog from its .mo file.
+
+        args:
+            language: The language directory name.
+
+        returns:
+            The catalog.
+        """
+        start = perf_counter()
+        with open(f"{self.locale_dir}/{language}/LC_MESSAGES/bot.mo", "rb") as file:
+            catalog = gettext.GNUTranslations(file)
+        self._stats[language] = {
+            "load_ms": (perf_counter() - start) * 1000,
+            "bytes": catalog_size(catalog),
+        }
+        self._catalogs[language] = catalog
+        return catalog
+
+    def reload(self, language: str) -> None:
+        """
+        Swaps in a freshly loaded catalog if the language was loaded before,
+        otherwise the next use loads the new file anyway.
+
+        args:
+            language: The language directory name.
+        """
+        if language in self._catalogs:
+            self.load(language)
+
+    def preload(self, languages: List[str]) -> None:
+        for language in languages:
+            if language.strip() in self._languages:
+                self[language.strip()]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return dict(self._stats)
+
+
+def catalog_size(catalog: gettext.GNUTranslations) -> int:
+    """
+    Estimates the memory held by a catalog's messages.
+
+    args:
+        catalog: The catalog.
+
+    returns:
+        Bytes.
+    """
+    messages = getattr(catalog, "_catalog", {})
+    return getsizeof(messages) + sum(
+        getsizeof(key) + getsizeof(value) for key, value in messages.items()
+    )
+
+
+def swap_catalogs(compiled: List[str]) -> None:
+    """
+    Swaps recompiled catalogs into `initilized_langs`.
+
+    Content pre-rendered from the old catalogs is rebuilt on next use, see
+    `embeds.RenderCache`.
+
+    args:
+        compiled: The languages returned by `compile_catalogs`.
+    """
+    for language in compiled:
+        read_language_name(language)
+        initilized_langs.reload(language)
+
 
-for lang in languages:
-    initilized_langs[lang].install()
+initilized_langs = Catalogs(languages)
+initilized_langs.preload(get_setting("PRELOAD_LANGUAGES", "en").split(","))